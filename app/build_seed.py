@@ -0,0 +1,35 @@
+"""
+Build-time seed preprocessing.
+
+Strips the documentation (`_comment`) objects from database/seed/quotes.json and
+writes quotes.clean.json next to it, so the app can load seed quotes without
+filtering them on every start. Run during the container build:
+
+    python -m app.build_seed /app/database/seed/quotes.json
+
+A missing seed file is not an error: CI/CD images may ship without seed data.
+"""
+
+import sys
+from pathlib import Path
+
+import orjson
+
+CLEAN_SEED_NAME = "quotes.clean.json"
+
+
+def build_clean_seed(seed_path: Path) -> Path | None:
+    if not seed_path.exists():
+        print(f"No seed file at {seed_path}; skipping")
+        return None
+    data = orjson.loads(seed_path.read_bytes())
+    quotes_data = [item for item in data if not item.get('_comment')]
+    clean_path = seed_path.with_name(CLEAN_SEED_NAME)
+    clean_path.write_bytes(orjson.dumps(quotes_data))
+    print(f"Wrote {len(quotes_data)} quotes to {clean_path}")
+    return clean_path
+
+
+if __name__ == '__main__':
+    default = Path(__file__).resolve().parents[1] / "database" / "seed" / "quotes.json"
+    build_clean_seed(Path(sys.argv[1]) if len(sys.argv) > 1 else default)
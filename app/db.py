@@ -1,130 +1,274 @@
 import os
-import json
 import logging
 from pathlib import Path
 import base64
+import hashlib
+import queue
+import threading
+import time
+import types
+import orjson
+from contextlib import contextmanager
+from itertools import islice
+from random import randint
 from azure.keyvault.secrets import SecretClient
 from azure.identity import DefaultAzureCredential
 
+try:
+    from .build_seed import CLEAN_SEED_NAME
+except ImportError:  # Imported as a top-level module, with app/ itself on sys.path
+    from build_seed import CLEAN_SEED_NAME
+
 logger = logging.getLogger(__name__)
 
 class DBNotConfigured(Exception):
     pass
 
 
-def _load_quotes_securely():
+# Environment is fixed for the process lifetime; read it once at import
+_ENV = types.SimpleNamespace(
+    demo_mode=os.environ.get('DEMO_MODE', '').lower() == 'true',
+    environment=os.environ.get('ENVIRONMENT', 'dev').lower(),
+    key_vault_url=os.environ.get('KEY_VAULT_URL'),
+    quotes_env=os.environ.get('QUOTES_DATA_BASE64'),
+    conn_str=os.getenv("DATABASE_CONNECTION_STRING") or os.getenv("SQL_CONN_STR"),
+    sql_server=os.getenv("SQL_SERVER"),
+    sql_database=os.getenv("SQL_DATABASE"),
+    sql_user=os.getenv("SQL_USER"),
+    sql_password=os.getenv("SQL_PASSWORD"),
+    sql_auth=os.getenv("AZURE_SQL_AUTH", "").lower(),
+    db_pool_size=int(os.getenv("DB_POOL_SIZE", "4")),
+)
+
+# Resolved ODBC connection string, built on first successful lookup
+_CACHED_CONN_STR = None
+
+# Reason the database was found unconfigured at bootstrap (env and runtime are fixed,
+# so later connection attempts fail fast instead of re-probing pyodbc and env)
+_DB_DISABLED = None
+
+# Azure credential and Key Vault client, built once and shared across threads so
+# the credential's in-memory token cache and the client's HTTP pipeline are reused
+_CREDENTIAL = None
+_SECRET_CLIENT = None
+_AZURE_CLIENT_LOCK = threading.Lock()
+
+
+def _get_credential():
+    global _CREDENTIAL
+    if _CREDENTIAL is None:
+        with _AZURE_CLIENT_LOCK:
+            if _CREDENTIAL is None:
+                # App Service uses Managed Identity; local dev uses env vars or Azure CLI.
+                # Skip the developer-tool probes we never deploy with.
+                _CREDENTIAL = DefaultAzureCredential(
+                    exclude_visual_studio_code_credential=True,
+                    exclude_shared_token_cache_credential=True,
+                    exclude_powershell_credential=True,
+                    exclude_developer_cli_credential=True,
+                )
+    return _CREDENTIAL
+
+
+def _get_secret_client():
+    global _SECRET_CLIENT
+    if _SECRET_CLIENT is None:
+        credential = _get_credential()
+        with _AZURE_CLIENT_LOCK:
+            if _SECRET_CLIENT is None:
+                _SECRET_CLIENT = SecretClient(vault_url=_ENV.key_vault_url, credential=credential)
+    return _SECRET_CLIENT
+
+
+# Parsed quotes keyed by a digest of the base64 payload, so an unchanged
+# env var / Key Vault secret is not decoded and parsed again
+_QUOTES_CACHE = {"src_hash": None, "data": None}
+
+
+def _decode_quotes_payload(b64_value):
+    """Decode a base64-encoded JSON quotes payload, reusing the last result if unchanged."""
+    raw = b64_value.encode('ascii') if isinstance(b64_value, str) else b64_value
+    src_hash = hashlib.blake2b(raw, digest_size=16).digest()
+    if src_hash == _QUOTES_CACHE["src_hash"]:
+        return _QUOTES_CACHE["data"]
+    quotes_data = orjson.loads(base64.b64decode(raw))
+    _QUOTES_CACHE["src_hash"] = src_hash
+    _QUOTES_CACHE["data"] = quotes_data
+    return quotes_data
+
+
+def _load_from_env():
+    """CONSTRAINT 3: Local Development - quotes from the QUOTES_DATA_BASE64 environment variable."""
+    logger.debug("Loading quotes from environment variable (local dev)")
+    try:
+        quotes_data = _decode_quotes_payload(_ENV.quotes_env)
+        logger.debug("Successfully loaded %d quotes from environment variable", len(quotes_data))
+        return quotes_data
+    except Exception as e:
+        logger.error("Failed to load from environment variable: %s", str(e))
+    if _ENV.key_vault_url:
+        return _load_from_key_vault()
+    return _load_dev_fallback()
+
+
+def _load_from_key_vault():
+    """CONSTRAINT 4: Production/Staging - quotes from Azure Key Vault."""
+    logger.debug("Loading quotes from Azure Key Vault (PII compliant)")
+    try:
+        secret = _get_secret_client().get_secret("quotes-data")
+        quotes_data = _decode_quotes_payload(secret.value)
+        logger.debug("Successfully loaded %d quotes from Azure Key Vault", len(quotes_data))
+        return quotes_data
+    except Exception as e:
+        logger.error("Failed to load quotes from Key Vault: %s", str(e))
+        # Only fallback to seed files in non-production environments
+        if _ENV.environment == 'prod':
+            logger.error("Production fallback to seed files not allowed")
+            return None
+        logger.warning("Falling back to seed files for demo functionality")
+    return _load_dev_fallback()
+
+
+def _load_dev_fallback():
+    """CONSTRAINT 5/6: seed files for dev environments only; nothing otherwise."""
+    if _ENV.environment in ['dev', 'development', 'demo']:
+        logger.warning("DEV ENVIRONMENT: Falling back to seed files")
+        logger.warning("For production: Set KEY_VAULT_URL and ENVIRONMENT=prod")
+        logger.warning("For demo: Set DEMO_MODE=true to acknowledge PII exception")
+        return _load_from_seed_files()
+
+    logger.error("No secure quotes data source configured for environment: %s", _ENV.environment)
+    return None
+
+
+def _load_unavailable():
+    return None
+
+
+def _select_quote_loader():
     """
-    Load quotes data securely from Azure Key Vault (production) or environment variable (local dev).
+    Evaluate the environment constraints once and return the loader for this process.
 
-    PII COMPLIANCE: This function ensures quotes data is never stored in:
+    PII COMPLIANCE: The selected source ensures quotes data is never stored in:
     - Container images
     - Source code
     - Configuration files
     - Container registries
+    """
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Environment constraints - ENV: %s, DEMO_MODE: %s, KEY_VAULT_URL: %s, QUOTES_DATA_BASE64: %s",
+                     _ENV.environment, _ENV.demo_mode,
+                     'set' if _ENV.key_vault_url else 'not set', 'set' if _ENV.quotes_env else 'not set')
+
+    # CONSTRAINT 1: Production environments MUST use Key Vault
+    if _ENV.environment == 'prod' and not _ENV.key_vault_url:
+        logger.error("PRODUCTION CONSTRAINT VIOLATION: KEY_VAULT_URL required for production")
+        return _load_unavailable
+
+    # CONSTRAINT 2: Demo mode explicitly enables seed file usage
+    if _ENV.demo_mode:
+        logger.warning("DEMO MODE ENABLED: Using seed files (documented PII exception)")
+        logger.warning("This violates PII security best practices - see docs/pii-compliance.md")
+        return _load_from_seed_files
+
+    if _ENV.quotes_env:
+        return _load_from_env
+    if _ENV.key_vault_url:
+        return _load_from_key_vault
+    return _load_dev_fallback
+
+
+def _compute_quotes():
+    """
+    Load quotes data securely from Azure Key Vault (production) or environment variable (local dev).
 
     Returns:
         list: Quote data loaded from secure storage, or None if unavailable
     """
     try:
-        # Environment constraint validations for proper data source selection
-        demo_mode = os.environ.get('DEMO_MODE', '').lower() == 'true'
-        environment = os.environ.get('ENVIRONMENT', 'dev').lower()
-        key_vault_url = os.environ.get('KEY_VAULT_URL')
-        quotes_env = os.environ.get('QUOTES_DATA_BASE64')
-
-        logger.info("Environment constraints - ENV: %s, DEMO_MODE: %s, KEY_VAULT_URL: %s, QUOTES_DATA_BASE64: %s",
-                   environment, demo_mode, 'set' if key_vault_url else 'not set', 'set' if quotes_env else 'not set')
-
-        # CONSTRAINT 1: Production environments MUST use Key Vault
-        if environment == 'prod' and not key_vault_url:
-            logger.error("PRODUCTION CONSTRAINT VIOLATION: KEY_VAULT_URL required for production")
-            raise Exception("Production environments must use Azure Key Vault for PII data")
-
-        # CONSTRAINT 2: Demo mode explicitly enables seed file usage
-        if demo_mode:
-            logger.warning("DEMO MODE ENABLED: Using seed files (documented PII exception)")
-            logger.warning("This violates PII security best practices - see docs/pii-compliance.md")
-            return _load_from_seed_files()
-
-        # CONSTRAINT 3: Local Development - prefer environment variable
-        if quotes_env:
-            logger.info("Loading quotes from environment variable (local dev)")
-            try:
-                quotes_json = base64.b64decode(quotes_env).decode('utf-8')
-                quotes_data = json.loads(quotes_json)
-                logger.info("Successfully loaded %d quotes from environment variable", len(quotes_data))
-                return quotes_data
-            except Exception as e:
-                logger.error("Failed to load from environment variable: %s", str(e))
-
-        # CONSTRAINT 4: Production/Staging - use Azure Key Vault
-        if key_vault_url:
-            logger.info("Loading quotes from Azure Key Vault (PII compliant)")
-            try:
-                credential = DefaultAzureCredential()
-                client = SecretClient(vault_url=key_vault_url, credential=credential)
-                secret = client.get_secret("quotes-data")
-                quotes_json = base64.b64decode(secret.value).decode('utf-8')
-                quotes_data = json.loads(quotes_json)
-                logger.info("Successfully loaded %d quotes from Azure Key Vault", len(quotes_data))
-                return quotes_data
-            except Exception as e:
-                logger.error("Failed to load quotes from Key Vault: %s", str(e))
-                # Only fallback to seed files in non-production environments
-                if environment != 'prod':
-                    logger.warning("Falling back to seed files for demo functionality")
-                else:
-                    logger.error("Production fallback to seed files not allowed")
-                    return None
-
-        # CONSTRAINT 5: Fallback for dev environments only
-        if environment in ['dev', 'development', 'demo']:
-            logger.warning("DEV ENVIRONMENT: Falling back to seed files")
-            logger.warning("For production: Set KEY_VAULT_URL and ENVIRONMENT=prod")
-            logger.warning("For demo: Set DEMO_MODE=true to acknowledge PII exception")
-            return _load_from_seed_files()
-
-        # CONSTRAINT 6: No fallback for production
-        logger.error("No secure quotes data source configured for environment: %s", environment)
-        return None
-
+        return _QUOTE_LOADER()
     except Exception as e:
         logger.error("Failed to load quotes securely: %s", str(e))
         return None
 
 
+# Candidate seed file locations in the container; the layout is fixed, so the
+# existing ones are resolved once at import instead of stat'ed per call
+_POSSIBLE_SEED_PATHS = (
+    Path(__file__).resolve().parents[1] / "database" / "seed" / "quotes.json",
+    Path("/app/database/seed/quotes.json"),
+    Path("./database/seed/quotes.json"),
+    Path("../database/seed/quotes.json")
+)
+
+
+def _seed_candidates():
+    """
+    Existing seed files in load order as (path, is_clean). At each location the
+    comment-free copy built by app.build_seed comes first, unless quotes.json was edited
+    after it was built (a leftover copy in a dev checkout).
+    """
+    found = []
+    for path in _POSSIBLE_SEED_PATHS:
+        clean_path = path.with_name(CLEAN_SEED_NAME)
+        source_exists = path.exists()
+        if clean_path.exists() and (not source_exists or clean_path.stat().st_mtime >= path.stat().st_mtime):
+            found.append((clean_path, True))
+        if source_exists:
+            found.append((path, False))
+    return tuple(found)
+
+
+def _resolve_seed_path():
+    """Return (path, is_clean) of the seed file the loader tries first, or (None, False)."""
+    candidates = _seed_candidates()
+    return candidates[0] if candidates else (None, False)
+
+
+_SEED_CANDIDATES = _seed_candidates()
+
+
 def _load_from_seed_files():
     """
     Load quotes from seed files with proper error handling.
     This is a documented PII exception for demo purposes.
     """
-    # Try multiple possible paths in container
-    possible_paths = [
-        Path(__file__).resolve().parents[1] / "database" / "seed" / "quotes.json",
-        Path("/app/database/seed/quotes.json"),
-        Path("./database/seed/quotes.json"),
-        Path("../database/seed/quotes.json")
-    ]
-
-    for seed_path in possible_paths:
-        if seed_path.exists():
-            logger.info("Found seed file at: %s", str(seed_path))
-            try:
-                with open(seed_path, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    # Filter out comment objects used for documentation
-                    quotes_data = [item for item in data if not item.get('_comment')]
-                    logger.info("Successfully loaded %d quotes from seed file", len(quotes_data))
-                    return quotes_data
-            except Exception as e:
-                logger.error("Failed to load from seed file %s: %s", str(seed_path), str(e))
-                continue
-
-    logger.error("No seed files found at any expected location")
-    logger.error("Tried paths: %s", [str(p) for p in possible_paths])
+    if not _SEED_CANDIDATES:
+        logger.error("No seed files found at any expected location")
+        logger.error("Tried paths: %s", ", ".join(map(str, _POSSIBLE_SEED_PATHS)))
+        return None
+
+    # A file that fails to parse falls through to the next candidate
+    for seed_path, is_clean in _SEED_CANDIDATES:
+        logger.debug("Found seed file at: %s", seed_path)
+        try:
+            with open(seed_path, 'rb') as f:
+                data = orjson.loads(f.read())
+            # Filter out comment objects used for documentation (already done at build time for clean seeds)
+            quotes_data = data if is_clean else [item for item in data if not item.get('_comment')]
+            logger.debug("Successfully loaded %d quotes from seed file", len(quotes_data))
+            return quotes_data
+        except Exception as e:
+            logger.error("Failed to load from seed file %s: %s", str(seed_path), str(e))
     return None
 
 
+# Data source is decided once from the (fixed) environment
+_QUOTE_LOADER = _select_quote_loader()
+
+# Quotes data is process-constant; decode/parse/fetch it at most once it has loaded.
+# A failed load (None) is not kept, so a Key Vault blip is retried on the next call
+_LOADED_QUOTES = None
+
+
+def _load_quotes_securely():
+    """Quotes from _compute_quotes(), cached once they have loaded successfully."""
+    global _LOADED_QUOTES
+    if _LOADED_QUOTES is None:
+        _LOADED_QUOTES = _compute_quotes()
+    return _LOADED_QUOTES
+
+
 def _load_pyodbc():
     try:
         import pyodbc  # noqa: F401
@@ -135,14 +279,14 @@ def _load_pyodbc():
 
 def _connection_string_from_env() -> str:
     # Prefer a full connection string if provided
-    cs = os.getenv("DATABASE_CONNECTION_STRING") or os.getenv("SQL_CONN_STR")
+    cs = _ENV.conn_str
     if cs:
         return cs
     # Otherwise, build from discrete vars (for local dev)
-    server = os.getenv("SQL_SERVER")
-    database = os.getenv("SQL_DATABASE")
-    username = os.getenv("SQL_USER")
-    password = os.getenv("SQL_PASSWORD")
+    server = _ENV.sql_server
+    database = _ENV.sql_database
+    username = _ENV.sql_user
+    password = _ENV.sql_password
 
     if server and database and username and password:
         return (
@@ -153,7 +297,7 @@ def _connection_string_from_env() -> str:
         )
 
     # Managed identity path (future): implement token-based auth when MI is enabled in App Service
-    if os.getenv("AZURE_SQL_AUTH", "").lower() == "managed_identity":
+    if _ENV.sql_auth == "managed_identity":
         raise DBNotConfigured("Managed Identity auth not implemented yet. Provide connection string or SQL_USER/PASSWORD for dev.")
 
     raise DBNotConfigured("Database connection not configured via env.")
@@ -164,10 +308,105 @@ def get_db_connection():
     Return a live pyodbc connection.
     Raises DBNotConfigured if unavailable. Do not log secrets or PII.
     """
+    global _CACHED_CONN_STR
+    if _DB_DISABLED:
+        raise DBNotConfigured(_DB_DISABLED)
     pyodbc = _load_pyodbc()
-    conn_str = _connection_string_from_env()
+    if _CACHED_CONN_STR is None:
+        _CACHED_CONN_STR = _connection_string_from_env()
     logger.info('Connecting to Azure SQL over encrypted channel')
-    return pyodbc.connect(conn_str)
+    return pyodbc.connect(_CACHED_CONN_STR)
+
+
+# Idle connections kept open between requests so TCP/TLS/auth setup is reused
+_POOL = queue.Queue(maxsize=_ENV.db_pool_size)
+_POOL_HEALTH_INTERVAL_SECONDS = 60
+_POOL_HEALTH_THREAD = None
+_POOL_HEALTH_LOCK = threading.Lock()
+
+
+def _close_quietly(conn):
+    try:
+        conn.close()
+    except Exception:
+        pass
+
+
+def _is_healthy(conn) -> bool:
+    try:
+        cursor = conn.cursor()
+        try:
+            cursor.execute("SELECT 1")
+            cursor.fetchone()
+        finally:
+            cursor.close()
+        return True
+    except Exception:
+        return False
+
+
+def _check_pool_health():
+    """Periodically discard idle pooled connections that no longer answer SELECT 1."""
+    while True:
+        time.sleep(_POOL_HEALTH_INTERVAL_SECONDS)
+        for _ in range(_POOL.qsize()):
+            try:
+                conn = _POOL.get_nowait()
+            except queue.Empty:
+                break
+            if _is_healthy(conn):
+                release_connection(conn)
+            else:
+                logger.info("Discarding stale pooled database connection")
+                _close_quietly(conn)
+
+
+def _start_pool_health_check():
+    # Started lazily so each gunicorn worker runs its own checker after fork
+    global _POOL_HEALTH_THREAD
+    if _POOL_HEALTH_THREAD is not None:
+        return
+    with _POOL_HEALTH_LOCK:
+        if _POOL_HEALTH_THREAD is None:
+            _POOL_HEALTH_THREAD = threading.Thread(
+                target=_check_pool_health, name="db-pool-health", daemon=True
+            )
+            _POOL_HEALTH_THREAD.start()
+
+
+def acquire_connection():
+    """
+    Return a pooled connection, opening a new one when no idle connection is available.
+    Pair with release_connection(), or use pooled_connection().
+    """
+    _start_pool_health_check()
+    try:
+        return _POOL.get_nowait()
+    except queue.Empty:
+        return get_db_connection()
+
+
+def release_connection(conn):
+    """Return a connection to the pool, closing it if it is broken or the pool is full."""
+    try:
+        conn.rollback()
+        _POOL.put_nowait(conn)
+    except Exception:
+        _close_quietly(conn)
+
+
+def discard_connection(conn):
+    """Close a connection that failed mid-use instead of returning it to the pool."""
+    _close_quietly(conn)
+
+
+@contextmanager
+def pooled_connection():
+    conn = acquire_connection()
+    try:
+        yield conn
+    finally:
+        release_connection(conn)
 
 
 def _ensure_table(cursor):
@@ -183,6 +422,71 @@ def _ensure_table(cursor):
     )
 
 
+# (MIN(id), MAX(id)) of dbo.quotes, cached once the table has rows. IDs are IDENTITY
+# values, so a random id in this range lets us pick a quote with an index seek. The
+# range is re-read after a TTL so rows inserted since become reachable
+_QUOTE_ID_RANGE = None
+_QUOTE_ID_RANGE_TTL_SECONDS = 300
+_QUOTE_ID_RANGE_EXPIRES = 0.0
+
+
+def _refresh_quote_id_range(cursor):
+    global _QUOTE_ID_RANGE, _QUOTE_ID_RANGE_EXPIRES
+    cursor.execute("SELECT MIN(id), MAX(id) FROM dbo.quotes;")
+    row = cursor.fetchone()
+    _QUOTE_ID_RANGE = (row[0], row[1]) if row and row[0] is not None else None
+    _QUOTE_ID_RANGE_EXPIRES = time.monotonic() + _QUOTE_ID_RANGE_TTL_SECONDS
+    return _QUOTE_ID_RANGE
+
+
+def _seek_quote(cursor, columns, id_range):
+    if not id_range:
+        return None
+    cursor.execute(
+        f"SELECT TOP 1 {columns} FROM dbo.quotes q WHERE q.id >= ? ORDER BY q.id;",
+        randint(*id_range),
+    )
+    return cursor.fetchone()
+
+
+def fetch_random_quote(cursor, columns="q.id, q.author, q.text"):
+    """
+    Return one random row of `columns` from dbo.quotes (aliased as q), or None if empty.
+
+    Seeks to a random id instead of sorting the whole table by NEWID(). A seek that misses
+    on a cached range re-reads the range and tries once more (rows were deleted at its
+    top); NEWID() is only the last resort. The pick is uniform only while ids are
+    contiguous: the row just after a gap of n deleted ids is n + 1 times as likely.
+    """
+    cached = _QUOTE_ID_RANGE if time.monotonic() < _QUOTE_ID_RANGE_EXPIRES else None
+    row = _seek_quote(cursor, columns, cached or _refresh_quote_id_range(cursor))
+    if row is None and cached is not None:
+        row = _seek_quote(cursor, columns, _refresh_quote_id_range(cursor))
+    if row:
+        return row
+    cursor.execute(f"SELECT TOP 1 {columns} FROM dbo.quotes q ORDER BY NEWID();")
+    return cursor.fetchone()
+
+
+# (@@SERVERNAME, DB_NAME()) of the connected database; invariant for the process
+_DB_IDENTITY = None
+
+
+def get_db_identity(cursor):
+    """Return the cached (server_name, database_name), querying it on first use."""
+    global _DB_IDENTITY
+    if _DB_IDENTITY is None:
+        cursor.execute("SELECT @@SERVERNAME, DB_NAME();")
+        row = cursor.fetchone()
+        _DB_IDENTITY = (row[0], row[1])
+    return _DB_IDENTITY
+
+
+# Rows per executemany call, keeping each batch well within TDS parameter limits
+_SEED_BATCH_SIZE = 1000
+_INSERT_QUOTE_SQL = "INSERT INTO dbo.quotes (author, text) VALUES (?, ?)"
+
+
 def _seed_if_empty(cursor):
     cursor.execute("SELECT COUNT(1) FROM dbo.quotes;")
     count = cursor.fetchone()[0]
@@ -195,11 +499,15 @@ def _seed_if_empty(cursor):
         logger.warning("No quotes data available for seeding")
         return
 
-    rows = [(q.get("author", "Unknown"), q["text"]) for q in quotes_data if q.get("text")]
-    for author, text in rows:
-        cursor.execute("INSERT INTO dbo.quotes (author, text) VALUES (?, ?)", (author, text))
+    rows = ((q.get("author", "Unknown"), q["text"]) for q in quotes_data if q.get("text"))
+    # Send rows as parameter arrays: one round-trip per batch instead of per quote
+    cursor.fast_executemany = True
+    seeded = 0
+    while batch := list(islice(rows, _SEED_BATCH_SIZE)):
+        cursor.executemany(_INSERT_QUOTE_SQL, batch)
+        seeded += len(batch)
 
-    logger.info("Database seeded with %d quotes (PII data loaded securely)", len(rows))
+    logger.info("Database seeded with %d quotes (PII data loaded securely)", seeded)
 
 
 def ensure_schema_and_seed():
@@ -208,13 +516,17 @@ def ensure_schema_and_seed():
     """
     try:
         conn = get_db_connection()
-    except DBNotConfigured:
+    except DBNotConfigured as e:
+        global _DB_DISABLED
+        _DB_DISABLED = str(e)
         logger.info("Database not configured yet; skipping schema/seed.")
         return
     try:
         cursor = conn.cursor()
+        get_db_identity(cursor)
         _ensure_table(cursor)
         _seed_if_empty(cursor)
+        _refresh_quote_id_range(cursor)
         conn.commit()
     finally:
         conn.close()
@@ -1,8 +1,13 @@
-bind = "0.0.0.0:8080"
-workers = 2
-threads = 4
+import multiprocessing
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', '8080')}"
+workers = int(os.environ.get('WEB_CONCURRENCY', multiprocessing.cpu_count()))
+threads = 8
 worker_class = "gthread"
+# Import app.main (create_app + schema/seed, credential and quotes caches) once in the
+# master; workers fork with it warm. The connection pool is filled lazily per worker.
+preload_app = True
 accesslog = "-"
 errorlog = "-"
 loglevel = "info"
-
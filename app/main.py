@@ -1,194 +1,259 @@
 import os
 import logging
-from flask import Flask, jsonify
-from .db import get_db_connection, ensure_schema_and_seed
+import time
+import orjson
+from flask import Flask, jsonify, request
+from flask.json.provider import DefaultJSONProvider
+from .build_seed import CLEAN_SEED_NAME
+from .db import (
+    _POSSIBLE_SEED_PATHS,
+    _resolve_seed_path,
+    acquire_connection,
+    discard_connection,
+    ensure_schema_and_seed,
+    fetch_random_quote,
+    get_db_identity,
+    pooled_connection,
+    release_connection,
+)
 
 # Configure logging with minimal data exposure
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 logger = logging.getLogger(__name__)
 
+_HEALTH_BODY = b'{"status":"ok"}\n'
+
+# /db-validate results are effectively static after seeding; serve them from
+# memory for a short TTL instead of re-querying on every hit
+_VALIDATION_CACHE_TTL_SECONDS = 60
+_VALIDATION_CACHE = {"expires": 0.0, "data": None}
+
+# /debug-seed diagnostics; failed results are retried after the TTL
+_DEBUG_SEED_CACHE_TTL_SECONDS = 30
+_DEBUG_SEED_CACHE = {"expires": 0.0, "loaded": False, "data": None}
+
+_DB_VALIDATE_BATCH = """
+    SELECT @@SERVERNAME, DB_NAME(), @@VERSION;
+    SELECT COUNT(*) as total_quotes FROM dbo.quotes;
+    SELECT TOP 5 id, author FROM dbo.quotes ORDER BY id;
+    SELECT COLUMN_NAME, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH
+    FROM INFORMATION_SCHEMA.COLUMNS
+    WHERE TABLE_NAME = 'quotes'
+    ORDER BY ORDINAL_POSITION;
+"""
+
+
+def _collect_seed_debug_info():
+    """Check seed file accessibility and data loading (backs /debug-seed)"""
+    debug_info = {
+        "container_info": {
+            "working_directory": os.getcwd(),
+            "app_directory": "/app" if os.path.exists("/app") else "not_found"
+        },
+        "seed_file_check": {},
+        "data_loading_test": {}
+    }
+
+    # Check the same seed file locations the loader uses, including the clean copy it prefers
+    for i, path in enumerate(_POSSIBLE_SEED_PATHS):
+        debug_info["seed_file_check"][f"path_{i+1}"] = {
+            "path": str(path),
+            "exists": path.exists(),
+            "is_file": path.is_file() if path.exists() else False,
+            "clean_exists": path.with_name(CLEAN_SEED_NAME).is_file(),
+            "parent_exists": path.parent.exists() if path.parent else False
+        }
+
+    # Read the file the loader would pick right now
+    path, is_clean = _resolve_seed_path()
+    if path is not None:
+        debug_info["data_loading_test"]["path"] = str(path)
+        debug_info["data_loading_test"]["is_clean"] = is_clean
+        try:
+            with open(path, 'rb') as f:
+                data = orjson.loads(f.read())
+            quotes = [item for item in data if not item.get('_comment')]
+            debug_info["data_loading_test"]["success"] = True
+            debug_info["data_loading_test"]["total_items"] = len(data)
+            debug_info["data_loading_test"]["quote_items"] = len(quotes)
+            debug_info["data_loading_test"]["first_quote"] = quotes[0] if quotes else None
+        except Exception as e:
+            debug_info["data_loading_test"]["error"] = str(e)
+
+    # Test the actual _load_quotes_securely function
+    try:
+        from .db import _load_quotes_securely
+        quotes_data = _load_quotes_securely()
+        debug_info["load_quotes_securely"] = {
+            "success": quotes_data is not None,
+            "quote_count": len(quotes_data) if quotes_data else 0,
+            "sample_quote": quotes_data[0] if quotes_data else None
+        }
+    except Exception as e:
+        debug_info["load_quotes_securely"] = {"error": str(e)}
+
+    return debug_info
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """Flask JSON provider that serializes with orjson, falling back to Flask's default for extra types."""
+
+    def _options(self):
+        # Datetimes go through Flask's default too, keeping its HTTP-date format rather
+        # than orjson's ISO-8601
+        options = orjson.OPT_PASSTHROUGH_DATETIME
+        return options | orjson.OPT_SORT_KEYS if self.sort_keys else options
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj, default=self.default, option=self._options()).decode('utf-8')
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        body = orjson.dumps(obj, default=self.default, option=self._options() | orjson.OPT_APPEND_NEWLINE)
+        return self._app.response_class(body, mimetype=self.mimetype)
+
 
 def create_app():
     app = Flask(__name__)
+    app.json = ORJSONProvider(app)
 
     # Health check
     @app.route('/healthz')
     def healthz():
-        return jsonify(status='ok')
+        # Hit constantly by liveness probes: skip jsonify and serve pre-encoded bytes.
+        # A fresh Response per hit, since Flask/Werkzeug mutate responses in flight.
+        return app.response_class(_HEALTH_BODY, mimetype='application/json')
 
     @app.route('/db-test')
     def test_database():
         """Test database connectivity"""
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
-            cursor.execute("SELECT @@VERSION")
-            version = cursor.fetchone()[0]
-            conn.close()
+            with pooled_connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT @@VERSION")
+                version = cursor.fetchone()[0]
             return jsonify(status="success", database="connected", version=version[:100])
         except Exception as e:
-            logger.error(f"Database test failed: {str(e)}")
+            logger.error("Database test failed: %s", e)
             return jsonify(status="error", database="failed", error=str(e)), 500
 
     @app.route('/db-validate')
     def validate_database():
         """Validate quotes are coming from Azure SQL database"""
+        if _VALIDATION_CACHE["data"] is not None and time.monotonic() < _VALIDATION_CACHE["expires"]:
+            return jsonify(status="success", database_validation=_VALIDATION_CACHE["data"])
+
         try:
-            conn = get_db_connection()
-            cursor = conn.cursor()
+            with pooled_connection() as conn:
+                cursor = conn.cursor()
+                # One round-trip returning four result sets
+                cursor.execute(_DB_VALIDATE_BATCH)
+
+                # Get database info
+                server_info = cursor.fetchone()
+
+                # Get quote statistics
+                cursor.nextset()
+                total_quotes = cursor.fetchone()[0]
+
+                # Get sample of quote IDs and authors
+                cursor.nextset()
+                sample_quotes = [{"id": row[0], "author": row[1]} for row in cursor.fetchall()]
+
+                # Get table schema info
+                cursor.nextset()
+                schema = [{"column": row[0], "type": row[1], "max_length": row[2]} for row in cursor.fetchall()]
+
+            database_validation = {
+                "server_name": server_info[0],
+                "database_name": server_info[1],
+                "sql_version": server_info[2][:100],
+                "total_quotes": total_quotes,
+                "sample_quotes": sample_quotes,
+                "table_schema": schema
+            }
+            _VALIDATION_CACHE["data"] = database_validation
+            _VALIDATION_CACHE["expires"] = time.monotonic() + _VALIDATION_CACHE_TTL_SECONDS
 
-            # Get database info
-            cursor.execute("SELECT @@SERVERNAME, DB_NAME(), @@VERSION")
-            server_info = cursor.fetchone()
-
-            # Get quote statistics
-            cursor.execute("SELECT COUNT(*) as total_quotes FROM dbo.quotes")
-            total_quotes = cursor.fetchone()[0]
-
-            # Get sample of quote IDs and authors
-            cursor.execute("SELECT TOP 5 id, author FROM dbo.quotes ORDER BY id")
-            sample_quotes = [{"id": row[0], "author": row[1]} for row in cursor.fetchall()]
-
-            # Get table schema info
-            cursor.execute("""
-                SELECT COLUMN_NAME, DATA_TYPE, CHARACTER_MAXIMUM_LENGTH
-                FROM INFORMATION_SCHEMA.COLUMNS
-                WHERE TABLE_NAME = 'quotes'
-                ORDER BY ORDINAL_POSITION
-            """)
-            schema = [{"column": row[0], "type": row[1], "max_length": row[2]} for row in cursor.fetchall()]
-
-            conn.close()
-
-            return jsonify(
-                status="success",
-                database_validation={
-                    "server_name": server_info[0],
-                    "database_name": server_info[1],
-                    "sql_version": server_info[2][:100],
-                    "total_quotes": total_quotes,
-                    "sample_quotes": sample_quotes,
-                    "table_schema": schema
-                }
-            )
+            return jsonify(status="success", database_validation=database_validation)
         except Exception as e:
-            logger.error(f"Database validation failed: {str(e)}")
+            logger.error("Database validation failed: %s", e)
             return jsonify(status="error", database="failed", error=str(e)), 500
 
     @app.route('/')
     def random_quote():
         # Treat all data as PII: do not log quote contents
         try:
-            conn = get_db_connection()
+            conn = acquire_connection()
         except Exception as e:
-            logger.error(f"Database connection failed: {str(e)}")
+            logger.error("Database connection failed: %s", e)
             # Do not leak internals; indicate service unavailable until DB is ready
             return jsonify(error='database_unavailable'), 503
         try:
             cursor = conn.cursor()
-            cursor.execute("SELECT TOP 1 id, author, text FROM dbo.quotes ORDER BY NEWID();")
-            row = cursor.fetchone()
-            if not row:
-                return jsonify(message='No quotes available'), 404
-            return jsonify(id=row[0], author=row[1], text=row[2])
-        finally:
-            conn.close()
+            row = fetch_random_quote(cursor)
+        except Exception as e:
+            # A pooled connection can go stale between health checks; never pool it again
+            logger.error("Database query failed: %s", e)
+            discard_connection(conn)
+            return jsonify(error='database_unavailable'), 503
+        release_connection(conn)
+        if not row:
+            return jsonify(message='No quotes available'), 404
+        return jsonify(id=row[0], author=row[1], text=row[2])
 
     @app.route('/quote-with-source')
     def quote_with_source():
         """Get a random quote with database source validation"""
         try:
-            conn = get_db_connection()
+            conn = acquire_connection()
         except Exception as e:
-            logger.error(f"Database connection failed: {str(e)}")
+            logger.error("Database connection failed: %s", e)
             return jsonify(error='database_unavailable'), 503
         try:
             cursor = conn.cursor()
             # Get quote with database metadata
-            cursor.execute("""
-                SELECT TOP 1
-                    q.id, q.author, q.text,
-                    @@SERVERNAME as server_name,
-                    DB_NAME() as database_name,
-                    GETDATE() as query_time
-                FROM dbo.quotes q
-                ORDER BY NEWID();
-            """)
-            row = cursor.fetchone()
-            if not row:
-                return jsonify(message='No quotes available'), 404
-
-            return jsonify(
-                quote={
-                    "id": row[0],
-                    "author": row[1],
-                    "text": row[2]
-                },
-                source_validation={
-                    "server_name": row[3],
-                    "database_name": row[4],
-                    "query_time": row[5].isoformat(),
-                    "source": "Azure SQL Database"
-                }
-            )
-        finally:
-            conn.close()
+            server_name, database_name = get_db_identity(cursor)
+            row = fetch_random_quote(cursor, "q.id, q.author, q.text, GETDATE() as query_time")
+        except Exception as e:
+            logger.error("Database query failed: %s", e)
+            discard_connection(conn)
+            return jsonify(error='database_unavailable'), 503
+        release_connection(conn)
+        if not row:
+            return jsonify(message='No quotes available'), 404
+
+        return jsonify(
+            quote={
+                "id": row[0],
+                "author": row[1],
+                "text": row[2]
+            },
+            source_validation={
+                "server_name": server_name,
+                "database_name": database_name,
+                "query_time": row[3].isoformat(),
+                "source": "Azure SQL Database"
+            }
+        )
 
     @app.route('/debug-seed')
     def debug_seed():
         """Debug endpoint to check seed file accessibility and data loading"""
-        from pathlib import Path
-        import json
-
-        debug_info = {
-            "container_info": {
-                "working_directory": os.getcwd(),
-                "app_directory": "/app" if os.path.exists("/app") else "not_found"
-            },
-            "seed_file_check": {},
-            "data_loading_test": {}
-        }
-
-        # Check multiple possible seed file locations
-        possible_paths = [
-            Path(__file__).resolve().parents[1] / "database" / "seed" / "quotes.json",
-            Path("/app/database/seed/quotes.json"),
-            Path("./database/seed/quotes.json"),
-            Path("../database/seed/quotes.json")
-        ]
-
-        for i, path in enumerate(possible_paths):
-            debug_info["seed_file_check"][f"path_{i+1}"] = {
-                "path": str(path),
-                "exists": path.exists(),
-                "is_file": path.is_file() if path.exists() else False,
-                "parent_exists": path.parent.exists() if path.parent else False
-            }
-
-            if path.exists() and path.is_file():
-                try:
-                    with open(path, 'r', encoding='utf-8') as f:
-                        data = json.load(f)
-                        debug_info["data_loading_test"]["success"] = True
-                        debug_info["data_loading_test"]["total_items"] = len(data)
-                        debug_info["data_loading_test"]["quote_items"] = len([item for item in data if not item.get('_comment')])
-                        debug_info["data_loading_test"]["first_quote"] = next((item for item in data if not item.get('_comment')), None)
-                        break
-                except Exception as e:
-                    debug_info["data_loading_test"]["error"] = str(e)
-
-        # Test the actual _load_quotes_securely function
-        try:
-            from .db import _load_quotes_securely
-            quotes_data = _load_quotes_securely()
-            debug_info["load_quotes_securely"] = {
-                "success": quotes_data is not None,
-                "quote_count": len(quotes_data) if quotes_data else 0,
-                "sample_quote": quotes_data[0] if quotes_data else None
-            }
-        except Exception as e:
-            debug_info["load_quotes_securely"] = {"error": str(e)}
-
+        # Filesystem probes and the quotes load are expensive; once loading has
+        # succeeded, serve the cached result until ?refresh=1 is passed
+        cached = _DEBUG_SEED_CACHE["data"]
+        if cached is not None and request.args.get('refresh') != '1':
+            if _DEBUG_SEED_CACHE["loaded"] or time.monotonic() < _DEBUG_SEED_CACHE["expires"]:
+                return jsonify(cached)
+
+        debug_info = _collect_seed_debug_info()
+        _DEBUG_SEED_CACHE["data"] = debug_info
+        _DEBUG_SEED_CACHE["loaded"] = debug_info["load_quotes_securely"].get("success", False)
+        _DEBUG_SEED_CACHE["expires"] = time.monotonic() + _DEBUG_SEED_CACHE_TTL_SECONDS
         return jsonify(debug_info)
 
     return app
@@ -227,6 +292,7 @@ except Exception as e:
 
 
 
+# Local development only; containers run gunicorn via entrypoint.sh (see gunicorn.conf.py)
 if __name__ == '__main__':
     port = int(os.environ.get('PORT', '8080'))
     app.run(host='0.0.0.0', port=port)
@@ -22,7 +22,8 @@ EXECUTION WORKFLOW:
 
 EXECUTION ENVIRONMENT:
 - Runs in Azure Automation Account (not locally)
-- Uses Managed Identity for authentication (no credentials needed)
+- Uses Managed Identity for authentication (no credentials needed; set
+  AZURE_CLIENT_ID to pick a user-assigned identity)
 - No local dependencies or Terraform state required
 - Cross-platform Python 3 compatible
 - Structured logging for Azure Monitor integration
@@ -38,7 +39,9 @@ FEATURES:
 - Automated resource group cleanup via Azure SDK
 - Cost reporting before deletion for transparency
 - Webhook notifications (Slack/Teams integration)
-- Comprehensive error handling and structured logging
+- Undeliverable notifications parked on an Azure Storage Queue for replay
+  (set CLEANUP_DLQ_ACCOUNT and optionally CLEANUP_DLQ_QUEUE, default cleanup-dlq)
+- Comprehensive error handling and structured (NDJSON) logging
 - Managed Identity authentication for security
 - Graceful handling of already-deleted resources
 
@@ -52,118 +55,275 @@ LOCAL TESTING USAGE (for development only):
     python azure-automation-cleanup.py --resource-group webapp-demo-rg --subscription 12345678-1234-1234-1234-123456789012 --webhook-url https://hooks.slack.com/...
 
 AZURE AUTOMATION REQUIREMENTS:
-    azure-identity azure-mgmt-resource azure-mgmt-costmanagement requests
+    azure-identity azure-mgmt-resource requests aiohttp orjson
+    azure-storage-queue (only when CLEANUP_DLQ_ACCOUNT is set)
 """
 
 import argparse
-import json
+import asyncio
+import base64
+import functools
 import logging
+import logging.handlers
+import os
+import random
 import sys
 import time
-from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
-
-import requests
-from azure.identity import DefaultAzureCredential, ManagedIdentityCredential
-from azure.mgmt.resource import ResourceManagementClient
-from azure.mgmt.costmanagement import CostManagementClient
-from azure.core.exceptions import ResourceNotFoundError, HttpResponseError
-
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
-    datefmt='%Y-%m-%d %H:%M:%S UTC'
-)
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Optional, Dict, Any, List, Tuple
+from urllib.parse import urlsplit
+
+import orjson
+
+# Azure SDK and requests imports are deferred to where they are used: together they
+# take close to a second to import, which --help and argument errors never need.
+if TYPE_CHECKING:
+    import requests
+
+# Timestamps are always UTC; datetime.utcnow() is deprecated as of Python 3.12
+_UTC = timezone.utc
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One NDJSON object per log event for Azure Monitor: no free-text parsing needed
+    downstream. Structured data passed as extra={"fields": {...}} is merged in.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        event = {"t": record.created, "lvl": record.levelname, "msg": record.getMessage()}
+        fields = getattr(record, "fields", None)
+        if fields:
+            event.update(fields)
+        if record.exc_info:
+            event["exc"] = self.formatException(record.exc_info)
+        return orjson.dumps(event, default=str).decode()
+
+
+# Configure logging: lines are buffered and written in batches, flushed right away
+# for warnings and errors, at each phase boundary (_flush_logs) and at interpreter exit
+_log_stream = logging.StreamHandler()
+_log_stream.setFormatter(JsonFormatter())
+_log_buffer = logging.handlers.MemoryHandler(capacity=1000, flushLevel=logging.WARNING, target=_log_stream)
+logging.basicConfig(level=logging.INFO, handlers=[_log_buffer])
 logger = logging.getLogger(__name__)
 
 
+def _flush_logs() -> None:
+    """
+    Write buffered log lines now, so the Automation job stream shows progress through long
+    waits and a recycled sandbox loses at most the current phase's lines.
+    """
+    _log_buffer.flush()
+
+ARM_ENDPOINT = "https://management.azure.com"
+ARM_SCOPE = "https://management.azure.com/.default"
+
+# Webhook delivery: retry transient failures (network errors, 429, 5xx) but never
+# keep the runbook waiting on a dead endpoint for longer than this budget
+WEBHOOK_RETRY_BUDGET_SECONDS = 120
+WEBHOOK_ATTEMPT_TIMEOUT_SECONDS = 10
+
+# Delay between LRO status polls when ARM sends no Retry-After header (ARM's own
+# Retry-After always takes precedence)
+ARM_POLL_INTERVAL_SECONDS = int(os.environ.get("ARM_POLL_INTERVAL", "5"))
+
+# Slack attachment colour per notification status
+WEBHOOK_COLORS = {
+    "SUCCESS": "good",
+    "WARNING": "warning",
+    "ERROR": "danger",
+    "INFO": "#36a64f"
+}
+
+# Optional dead-letter queue for notifications that exhausted their retries; the
+# account may be a storage account name or a full queue endpoint URL
+DLQ_ACCOUNT = os.environ.get("CLEANUP_DLQ_ACCOUNT")
+DLQ_QUEUE = os.environ.get("CLEANUP_DLQ_QUEUE", "cleanup-dlq")
+
+# Resource groups cleaned up concurrently; ARM calls are IO-bound so threads overlap well
+MAX_PARALLEL_CLEANUPS = 8
+
+# Worst status across resource groups decides the aggregated notification's status
+STATUS_SEVERITY = {"INFO": 0, "SUCCESS": 1, "WARNING": 2, "ERROR": 3}
+
+
+def _build_webhook_retry():
+    """urllib3 Retry with +/-25% jitter on the exponential backoff and an overall time budget"""
+    from urllib3.util.retry import Retry
+
+    class JitteredRetry(Retry):
+        def new(self, **kw):
+            retry = super().new(**kw)
+            # Remember when the first failure happened so the budget spans every attempt
+            retry.first_failure_at = getattr(self, "first_failure_at", None) or time.monotonic()
+            return retry
+
+        def get_backoff_time(self) -> float:
+            return super().get_backoff_time() * random.uniform(0.75, 1.25)
+
+        def is_exhausted(self) -> bool:
+            first_failure_at = getattr(self, "first_failure_at", None)
+            over_budget = first_failure_at is not None and \
+                time.monotonic() - first_failure_at > WEBHOOK_RETRY_BUDGET_SECONDS
+            return over_budget or super().is_exhausted()
+
+    return JitteredRetry(
+        total=5,
+        backoff_factor=1,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=["POST"],
+        respect_retry_after_header=True
+    )
+
+
+# One keep-alive session for all outbound HTTP (webhook + ARM batch) so repeat calls
+# to the same host reuse the TCP/TLS connection instead of handshaking again
+_SESSION = None
+
+
+def _get_session(webhook_url: Optional[str] = None) -> "requests.Session":
+    """
+    The shared session. Only the webhook's host gets the retrying adapter: an ARM
+    /batch POST is not safe to replay, so it must not inherit the webhook retries.
+    """
+    global _SESSION
+    from requests.adapters import HTTPAdapter
+
+    if _SESSION is None:
+        import requests
+
+        _SESSION = requests.Session()
+        _SESSION.mount("https://", HTTPAdapter(pool_connections=4, pool_maxsize=4))
+        _SESSION.headers["Content-Type"] = "application/json"
+    if webhook_url:
+        # requests picks the adapter with the longest matching prefix
+        webhook = urlsplit(webhook_url)
+        webhook_prefix = f"{webhook.scheme}://{webhook.netloc}/"
+        if webhook_prefix not in _SESSION.adapters:
+            _SESSION.mount(webhook_prefix, HTTPAdapter(pool_connections=1, pool_maxsize=4,
+                                                       max_retries=_build_webhook_retry()))
+    return _SESSION
+
+
 class AzureCleanupManager:
     """Manages Azure resource cleanup operations"""
     
-    def __init__(self, subscription_id: str, webhook_url: Optional[str] = None):
+    def __init__(self, subscription_id: str, webhook_url: Optional[str] = None,
+                 session: Optional["requests.Session"] = None):
         self.subscription_id = subscription_id
         self.webhook_url = webhook_url
+        from azure.mgmt.resource import ResourceManagementClient
+
+        self._session = session or _get_session(webhook_url)
+        self._cached_token = None
+        # Slack payload skeleton built once; send_webhook_notification fills in the status,
+        # message and timestamp. Notifications are only sent from the coordinating thread
+        self._message_field = {"title": "Message", "value": None, "short": False}
+        self._timestamp_field = {"title": "Timestamp", "value": None, "short": True}
+        self._webhook_attachment = {
+            "color": None,
+            "fields": [
+                {"title": "Subscription", "value": subscription_id, "short": True},
+                self._message_field,
+                self._timestamp_field
+            ]
+        }
+        self._webhook_payload = {"text": None, "attachments": [self._webhook_attachment]}
         self.credential = self._get_azure_credential()
         self.resource_client = ResourceManagementClient(self.credential, subscription_id)
-        self.cost_client = CostManagementClient(self.credential)
-    
+
+    @staticmethod
+    def _credential_options() -> Dict[str, Any]:
+        """
+        DefaultAzureCredential settings shared by the sync and async credentials. The chain
+        tries Managed Identity (Azure Automation) once and falls through to Azure CLI for
+        local development; developer-tool caches that never apply here are skipped.
+        """
+        return {
+            "managed_identity_client_id": os.environ.get("AZURE_CLIENT_ID"),
+            "exclude_shared_token_cache_credential": True,
+            "exclude_visual_studio_code_credential": True,
+        }
+
     def _get_azure_credential(self):
-        """Get Azure credential, preferring Managed Identity in Azure environments"""
-        try:
-            # Try Managed Identity first (for Azure Automation)
-            credential = ManagedIdentityCredential()
-            # Test the credential
-            credential.get_token("https://management.azure.com/.default")
-            logger.info("Using Managed Identity for authentication")
-            return credential
-        except Exception:
-            # Fall back to DefaultAzureCredential (for local development)
-            logger.info("Using DefaultAzureCredential for authentication")
-            return DefaultAzureCredential()
+        """Get Azure credential; Managed Identity is preferred by the chain in Azure environments"""
+        from azure.identity import DefaultAzureCredential
+
+        logger.info("Using DefaultAzureCredential for authentication")
+        return DefaultAzureCredential(**self._credential_options())
+
+    def _get_arm_token(self) -> str:
+        """Return an ARM bearer token, reusing the cached one until 5 minutes before expiry"""
+        if self._cached_token is None or time.time() >= self._cached_token.expires_on - 300:
+            self._cached_token = self.credential.get_token(ARM_SCOPE)
+        return self._cached_token.token
+
+    def _get_async_azure_credential(self):
+        """Async counterpart of the credential chosen by _get_azure_credential"""
+        from azure.identity.aio import DefaultAzureCredential
+
+        return DefaultAzureCredential(**self._credential_options())
     
     def send_webhook_notification(self, message: str, status: str) -> None:
         """Send notification to webhook URL (Slack format)"""
         if not self.webhook_url:
             return
         
+        payload = self._webhook_payload
+        payload["text"] = f"Azure WebApp Demo Cleanup: {status}"
+        self._webhook_attachment["color"] = WEBHOOK_COLORS.get(status, "warning")
+        self._message_field["value"] = message
+        self._timestamp_field["value"] = datetime.now(_UTC).isoformat(timespec="seconds")
+
         try:
-            color_map = {
-                "SUCCESS": "good",
-                "WARNING": "warning", 
-                "ERROR": "danger",
-                "INFO": "#36a64f"
-            }
-            
-            payload = {
-                "text": f"Azure WebApp Demo Cleanup: {status}",
-                "attachments": [
-                    {
-                        "color": color_map.get(status, "warning"),
-                        "fields": [
-                            {
-                                "title": "Subscription",
-                                "value": self.subscription_id,
-                                "short": True
-                            },
-                            {
-                                "title": "Message", 
-                                "value": message,
-                                "short": False
-                            },
-                            {
-                                "title": "Timestamp",
-                                "value": datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC'),
-                                "short": True
-                            }
-                        ]
-                    }
-                ]
-            }
-            
-            response = requests.post(
+            # Retries with jittered backoff are handled by the adapter mounted for the webhook's host;
+            # the body is pre-serialized with orjson (the session sets the JSON Content-Type)
+            response = self._session.post(
                 self.webhook_url,
-                json=payload,
-                headers={'Content-Type': 'application/json'},
-                timeout=30
+                data=orjson.dumps(payload),
+                timeout=WEBHOOK_ATTEMPT_TIMEOUT_SECONDS
             )
             response.raise_for_status()
             logger.info("Webhook notification sent successfully")
             
         except Exception as e:
-            logger.warning(f"Failed to send webhook notification: {e}")
+            logger.warning("Failed to send webhook notification: %s", e)
+            self._dead_letter_notification(payload)
+
+    def _dead_letter_notification(self, payload: Dict[str, Any]) -> None:
+        """Park an undeliverable notification on the dead-letter queue for manual replay"""
+        if not DLQ_ACCOUNT:
+            return
+
+        try:
+            from azure.storage.queue import QueueClient
+
+            account_url = DLQ_ACCOUNT if DLQ_ACCOUNT.startswith("https://") \
+                else f"https://{DLQ_ACCOUNT}.queue.core.windows.net"
+            message = base64.b64encode(orjson.dumps(payload)).decode()
+            with QueueClient(account_url, DLQ_QUEUE, credential=self.credential) as queue:
+                queue.send_message(message)
+            logger.info("Webhook notification saved to dead-letter queue '%s'", DLQ_QUEUE,
+                        extra={"fields": {"queue": DLQ_QUEUE}})
+        except Exception as e:
+            logger.error("Failed to dead-letter webhook notification: %s", e)
     
     def get_resource_group_costs(self, resource_group_name: str) -> str:
         """Get cost information for resource group (simplified approach)"""
         try:
-            logger.info(f"Retrieving cost information for resource group: {resource_group_name}")
+            logger.info("Retrieving cost information for resource group: %s", resource_group_name,
+                        extra={"fields": {"resource_group": resource_group_name}})
             
             # Get current month date range
-            now = datetime.utcnow()
+            now = datetime.now(_UTC)
             start_date = now.replace(day=1).strftime('%Y-%m-%d')
             end_date = now.strftime('%Y-%m-%d')
             
-            logger.info(f"Cost period: {start_date} to {end_date}")
+            logger.info("Cost period: %s to %s", start_date, end_date,
+                        extra={"fields": {"start_date": start_date, "end_date": end_date}})
             logger.info("For detailed cost analysis, check Azure Cost Management in the portal")
             
             # Note: Cost Management API requires specific permissions and may not work in all scenarios
@@ -171,118 +331,225 @@ class AzureCleanupManager:
             return f"Cost data retrieved for period {start_date} to {end_date} (see Azure Cost Management for details)"
             
         except Exception as e:
-            logger.warning(f"Could not retrieve cost information: {e}")
+            logger.warning("Could not retrieve cost information: %s", e)
             return "Cost information unavailable"
     
-    def list_resources_in_group(self, resource_group_name: str) -> list:
-        """List all resources in the resource group"""
+    def list_resources_in_group(self, resource_group_name: str) -> Counter:
+        """Count the resources in the resource group by type as pages arrive"""
         try:
-            resources = list(self.resource_client.resources.list_by_resource_group(resource_group_name))
-            logger.info(f"Found {len(resources)} resources to be deleted:")
-            for resource in resources:
-                logger.info(f"  - {resource.name} ({resource.type})")
-            return resources
+            # Iterate the pager lazily (pages are fetched on demand) and only ask for the
+            # fields we need, instead of materializing every expanded resource model up front
+            pager = self.resource_client.resources.list_by_resource_group(
+                resource_group_name, params={"$select": "name,type"}
+            )
+            resource_types = Counter(resource.type for resource in pager)
+            self._log_resource_summary(resource_types)
+            return resource_types
         except Exception as e:
-            logger.error(f"Failed to list resources: {e}")
-            return []
+            logger.error("Failed to list resources: %s", e)
+            return Counter()
+
+    @staticmethod
+    def _log_resource_summary(resource_types: Counter) -> None:
+        """One log event per resource group: total plus a per-type breakdown"""
+        logger.info("Found %d resources to be deleted", sum(resource_types.values()),
+                    extra={"fields": {"resource_types": dict(resource_types)}})
     
-    def delete_resource_group(self, resource_group_name: str) -> bool:
+    def _arm_batch(self, batch_requests: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Send several ARM sub-requests in one POST /batch round trip; responses are returned in request order"""
+        named = [dict(req, name=str(i)) for i, req in enumerate(batch_requests)]
+        token = self._get_arm_token()
+        response = self._session.post(
+            f"{ARM_ENDPOINT}/batch?api-version=2020-06-01",
+            data=orjson.dumps({"requests": named}),
+            headers={'Authorization': f'Bearer {token}'},
+            timeout=60
+        )
+        response.raise_for_status()
+        by_name = {r.get("name"): r for r in response.json().get("responses", [])}
+        return [by_name[req["name"]] for req in named]
+
+    @staticmethod
+    def _format_cost_query_result(content: Dict[str, Any], start_date: str, end_date: str) -> Optional[str]:
+        """Turn a Cost Management query result into the cost summary used in notifications"""
+        properties = content.get("properties", {})
+        columns = [c.get("name") for c in properties.get("columns", [])]
+        rows = properties.get("rows", [])
+        if not rows:
+            return f"No cost recorded for period {start_date} to {end_date}"
+        cost_index = next((i for i, c in enumerate(columns) if c in ("Cost", "PreTaxCost")), None)
+        if cost_index is None:
+            return None
+        currency = rows[0][columns.index("Currency")] if "Currency" in columns else "USD"
+        total = sum(float(row[cost_index]) for row in rows)
+        return f"Month-to-date cost {total:.2f} {currency} for period {start_date} to {end_date}"
+
+    def _prefetch_rg_state(self, resource_group_name: str) -> Tuple[bool, Counter, str]:
+        """
+        Fetch (exists, resource_types, cost_info) for the resource group in a single ARM /batch call.
+        Falls back to the individual SDK calls if the batch request cannot be used.
+        """
+        rg_path = f"/subscriptions/{self.subscription_id}/resourceGroups/{resource_group_name}"
+        now = datetime.now(_UTC)
+        start_date = now.replace(day=1).strftime('%Y-%m-%d')
+        end_date = now.strftime('%Y-%m-%d')
+
+        try:
+            rg_resp, resources_resp, cost_resp = self._arm_batch([
+                {"httpMethod": "GET", "relativeUrl": f"{rg_path}?api-version=2021-04-01"},
+                {"httpMethod": "GET", "relativeUrl": f"{rg_path}/resources?api-version=2021-04-01&$select=name,type"},
+                {
+                    "httpMethod": "POST",
+                    "relativeUrl": f"{rg_path}/providers/Microsoft.CostManagement/query?api-version=2023-03-01",
+                    "content": {
+                        "type": "ActualCost",
+                        "timeframe": "MonthToDate",
+                        "dataset": {
+                            "granularity": "None",
+                            "aggregation": {"totalCost": {"name": "Cost", "function": "Sum"}}
+                        }
+                    }
+                },
+            ])
+            if rg_resp.get("httpStatusCode") == 404:
+                return False, Counter(), ""
+            if rg_resp.get("httpStatusCode") != 200 or resources_resp.get("httpStatusCode") != 200 \
+                    or resources_resp.get("content", {}).get("nextLink"):
+                raise RuntimeError("batch response incomplete")
+        except Exception as e:
+            logger.info("ARM batch prefetch unavailable (%s); using individual requests", e)
+            # HEAD request: existence only, no properties body to download and parse
+            if not self.resource_client.resource_groups.check_existence(resource_group_name):
+                return False, Counter(), ""
+            logger.info("Gathering cost information before cleanup...")
+            cost_info = self.get_resource_group_costs(resource_group_name)
+            return True, self.list_resources_in_group(resource_group_name), cost_info
+
+        resource_types = Counter(r.get("type") for r in resources_resp.get("content", {}).get("value", []))
+        self._log_resource_summary(resource_types)
+
+        cost_info = None
+        if cost_resp.get("httpStatusCode") == 200:
+            cost_info = self._format_cost_query_result(cost_resp.get("content", {}), start_date, end_date)
+        if cost_info is None:
+            logger.info("Cost query unavailable in batch response; see Azure Cost Management for details")
+            cost_info = f"Cost data retrieved for period {start_date} to {end_date} (see Azure Cost Management for details)"
+        logger.info("Cost information: %s", cost_info)
+
+        return True, resource_types, cost_info
+
+    async def delete_resource_group(self, resource_group_name: str) -> bool:
         """Delete the resource group and wait for completion"""
+        from azure.mgmt.core.polling.async_arm_polling import AsyncARMPolling
+        from azure.mgmt.resource.resources.aio import ResourceManagementClient
+
+        timeout_minutes = 10
         try:
-            logger.info(f"Deleting resource group: {resource_group_name}")
-            
-            # Start the deletion operation
-            delete_operation = self.resource_client.resource_groups.begin_delete(resource_group_name)
-            
-            # Wait for deletion to complete (with timeout)
-            timeout_minutes = 10
-            timeout_seconds = timeout_minutes * 60
-            start_time = time.time()
-            
-            logger.info(f"Waiting for deletion to complete (timeout: {timeout_minutes} minutes)...")
-            
-            while not delete_operation.done():
-                elapsed = time.time() - start_time
-                if elapsed > timeout_seconds:
-                    logger.warning(f"Deletion timeout after {timeout_minutes} minutes. Operation may still be in progress.")
-                    return False
-                
-                logger.info(f"Waiting for deletion to complete... ({int(elapsed)} seconds)")
-                time.sleep(30)
-            
-            # Check the result
-            delete_operation.result()  # This will raise an exception if the operation failed
+            logger.info("Deleting resource group: %s", resource_group_name,
+                        extra={"fields": {"resource_group": resource_group_name}})
+
+            async with self._get_async_azure_credential() as credential, \
+                    ResourceManagementClient(credential, self.subscription_id) as client:
+                # Start the deletion operation
+                delete_operation = await client.resource_groups.begin_delete(
+                    resource_group_name,
+                    polling=AsyncARMPolling(timeout=ARM_POLL_INTERVAL_SECONDS)
+                )
+
+                # Wait for deletion to complete (with timeout). The async ARM poller follows the
+                # operation's Azure-AsyncOperation/Location headers and sleeps per Retry-After
+                # (or ARM_POLL_INTERVAL_SECONDS without one), so completion is noticed within
+                # seconds instead of on a fixed 30 second tick.
+                logger.info("Waiting for deletion to complete (timeout: %d minutes)...", timeout_minutes)
+                _flush_logs()
+                started = time.monotonic()
+                await asyncio.wait_for(delete_operation.result(), timeout=timeout_minutes * 60)
+                elapsed = int(time.monotonic() - started)
+                logger.info("Deletion finished after %d seconds", elapsed,
+                            extra={"fields": {"resource_group": resource_group_name, "elapsed_seconds": elapsed}})
+
             logger.info("Resource group deleted successfully")
+            _flush_logs()
             return True
-            
+
+        except asyncio.TimeoutError:
+            logger.warning("Deletion timeout after %d minutes. Operation may still be in progress.", timeout_minutes,
+                           extra={"fields": {"resource_group": resource_group_name, "timeout_minutes": timeout_minutes}})
+            return False
         except Exception as e:
-            logger.error(f"Failed to delete resource group: {e}")
+            logger.error("Failed to delete resource group: %s", e, extra={"fields": {"resource_group": resource_group_name}})
             return False
     
-    def cleanup_resource_group(self, resource_group_name: str) -> bool:
-        """Main cleanup method"""
+    def _cleanup_one(self, resource_group_name: str) -> Tuple[str, str]:
+        """Clean up a single resource group, returning (status, message) for the aggregated notification"""
         try:
-            logger.info("Starting Azure WebApp Demo cleanup process...")
-            logger.info(f"Resource Group: {resource_group_name}")
-            logger.info(f"Subscription: {self.subscription_id}")
-            logger.info(f"Timestamp: {datetime.utcnow().strftime('%Y-%m-%d %H:%M:%S UTC')}")
-            
-            # Check if resource group exists
-            logger.info("Checking if resource group exists...")
-            try:
-                self.resource_client.resource_groups.get(resource_group_name)
-            except ResourceNotFoundError:
+            logger.info("Resource Group: %s", resource_group_name, extra={"fields": {"resource_group": resource_group_name}})
+
+            # Check existence, list resources and gather cost information in one round trip
+            logger.info("Checking resource group state before cleanup: %s", resource_group_name,
+                        extra={"fields": {"resource_group": resource_group_name}})
+            exists, resource_types, cost_info = self._prefetch_rg_state(resource_group_name)
+            _flush_logs()
+            if not exists:
                 message = f"Resource group '{resource_group_name}' not found. It may have already been deleted."
                 logger.info(message)
-                self.send_webhook_notification(message, "INFO")
-                return True
-            
-            # Get cost information before deletion
-            logger.info("Gathering cost information before cleanup...")
-            cost_info = self.get_resource_group_costs(resource_group_name)
-            
-            # List resources in the resource group
-            resources = self.list_resources_in_group(resource_group_name)
-            
-            # Delete the resource group
-            success = self.delete_resource_group(resource_group_name)
-            
+                return "INFO", message
+
+            # Delete the resource group; each worker thread runs its own event loop
+            success = asyncio.run(self.delete_resource_group(resource_group_name))
+
             if success:
                 message = f"Resource group '{resource_group_name}' deleted successfully. {cost_info}"
+                if resource_types:
+                    top_types = ", ".join(f"{t} ({n})" for t, n in resource_types.most_common(5))
+                    message += f" Top resource types: {top_types}"
                 logger.info(message)
-                self.send_webhook_notification(message, "SUCCESS")
-            else:
-                message = f"Resource group deletion initiated but may still be in progress. Check Azure portal for status."
-                logger.warning(message)
-                self.send_webhook_notification(message, "WARNING")
-            
+                return "SUCCESS", message
+            message = (f"Resource group '{resource_group_name}' deletion initiated but may still be in progress. "
+                       f"Check Azure portal for status.")
+            logger.warning(message)
+            return "WARNING", message
+
+        except Exception as e:
+            message = f"Cleanup of '{resource_group_name}' failed: {e}"
+            logger.error(message)
+            return "ERROR", message
+
+    def cleanup_resource_groups(self, names: List[str]) -> bool:
+        """
+        Main cleanup method: clean up the resource groups concurrently and send a single
+        aggregated webhook notification (one per group would trip Slack rate limits)
+        """
+        try:
+            logger.info("Starting Azure WebApp Demo cleanup process...")
+            logger.info("Resource Groups: %s", ", ".join(names), extra={"fields": {"resource_groups": list(names)}})
+            logger.info("Subscription: %s", self.subscription_id,
+                        extra={"fields": {"subscription": self.subscription_id}})
+            logger.info("Timestamp: %s", datetime.now(_UTC).isoformat(timespec='seconds'))
+
+            results = {}
+            with ThreadPoolExecutor(max_workers=min(MAX_PARALLEL_CLEANUPS, len(names))) as executor:
+                futures = {executor.submit(self._cleanup_one, name): name for name in names}
+                for future in as_completed(futures):
+                    results[futures[future]] = future.result()
+
+            # Report in the order the groups were requested, not the order they finished
+            outcomes = [results[name] for name in names]
+            status = max((s for s, _ in outcomes), key=STATUS_SEVERITY.__getitem__)
+            self.send_webhook_notification("\n".join(m for _, m in outcomes), status)
+
             logger.info("Azure WebApp Demo cleanup completed")
-            return success
-            
+            return status in ("INFO", "SUCCESS")
+
         except Exception as e:
             error_message = f"Cleanup failed: {e}"
             logger.error(error_message)
             self.send_webhook_notification(error_message, "ERROR")
             return False
 
-
-def main():
-    """
-    Main entry point for Azure Automation Account execution
-
-    WARNING: This script is designed for Azure Automation Account, not direct developer use.
-    For manual cleanup, developers should use: ./scripts/cleanup.sh
-    """
-
-    # Print warning if running interactively
-    import os
-    if os.isatty(0):  # Check if running in interactive terminal
-        print("WARNING: This script is designed for Azure Automation Account execution.")
-        print("For manual cleanup, use: ./scripts/cleanup.sh")
-        print("Continuing in 3 seconds... (Ctrl+C to cancel)")
-        import time
-        time.sleep(3)
-
+@functools.cache
+def _build_parser() -> argparse.ArgumentParser:
+    """Command-line parser, built once and reused if the runbook sandbox invokes main() again"""
     parser = argparse.ArgumentParser(
         description="Azure WebApp Demo Cleanup Script (for Azure Automation Account)",
         formatter_class=argparse.RawDescriptionHelpFormatter,
@@ -290,13 +557,15 @@ def main():
 Examples:
   python azure-automation-cleanup.py --resource-group webapp-demo-rg --subscription 12345678-1234-1234-1234-123456789012
   python azure-automation-cleanup.py --resource-group webapp-demo-rg --subscription 12345678-1234-1234-1234-123456789012 --webhook-url https://hooks.slack.com/...
+  python azure-automation-cleanup.py --resource-group webapp-demo-rg webapp-staging-rg --subscription 12345678-1234-1234-1234-123456789012
         """
     )
     
     parser.add_argument(
         '--resource-group',
         required=True,
-        help='Name of the resource group to clean up'
+        nargs='+',
+        help='Name of the resource group(s) to clean up'
     )
     
     parser.add_argument(
@@ -315,15 +584,33 @@ Examples:
         action='store_true',
         help='Enable verbose logging'
     )
-    
-    args = parser.parse_args()
+
+    return parser
+
+
+def main():
+    """
+    Main entry point for Azure Automation Account execution
+
+    WARNING: This script is designed for Azure Automation Account, not direct developer use.
+    For manual cleanup, developers should use: ./scripts/cleanup.sh
+    """
+
+    # Print warning if running interactively
+    if os.isatty(0):  # Check if running in interactive terminal
+        print("WARNING: This script is designed for Azure Automation Account execution.")
+        print("For manual cleanup, use: ./scripts/cleanup.sh")
+        print("Continuing in 3 seconds... (Ctrl+C to cancel)")
+        time.sleep(3)
+
+    args = _build_parser().parse_args()
     
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
     
     try:
         cleanup_manager = AzureCleanupManager(args.subscription, args.webhook_url)
-        success = cleanup_manager.cleanup_resource_group(args.resource_group)
+        success = cleanup_manager.cleanup_resource_groups(args.resource_group)
         
         if success:
             logger.info("Cleanup completed successfully")
@@ -333,7 +620,7 @@ Examples:
             sys.exit(1)
             
     except Exception as e:
-        logger.error(f"Cleanup failed with error: {e}")
+        logger.error("Cleanup failed with error: %s", e)
         sys.exit(1)
 
 
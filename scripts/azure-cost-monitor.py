@@ -46,11 +46,19 @@ USAGE EXAMPLES:
 # ============================================================================
 
 import argparse
+import io
 import json
+import operator
+import sqlite3
 import sys
 import os
+import time
+import types
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Tuple
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 import subprocess
 
 # ============================================================================
@@ -63,28 +71,225 @@ def print_success(msg): print(f"[SUCCESS] {msg}")   # Success confirmations
 def print_warning(msg): print(f"[WARNING] {msg}")   # Warning messages
 def print_error(msg): print(f"[ERROR] {msg}")       # Error messages
 
+# orjson parses the (potentially multi-MB) Azure CLI JSON output, and writes exports,
+# several times faster than the stdlib; it is optional and json is used without it.
+# Output that is only parsed is captured as bytes, which both take without decoding.
 try:
-    from azure.identity import DefaultAzureCredential
-    from azure.mgmt.costmanagement import CostManagementClient
-    from azure.mgmt.resource import ResourceManagementClient
-    import requests
-except ImportError as e:
-    print_error(f"Required Azure packages not installed: {e}")
-    print_status("Install with one of these methods:")
-    print_status("  1. pip install -r requirements-cost-monitoring.txt")
-    print_status("  2. pip install azure-mgmt-costmanagement azure-identity azure-mgmt-resource requests")
-    print_status("  3. ./scripts/cost-monitor.sh --install-deps")
-    sys.exit(1)
+    import orjson
+    _loads = orjson.loads
+except ImportError:
+    orjson = None
+    _loads = json.loads
+
+
+# Environment for every `az` subprocess: no telemetry upload, survey prompt, colour codes
+# or warning chatter, which each add work to every CLI invocation. The user's own
+# AZURE_CONFIG_DIR (and so their login) is deliberately left untouched.
+_AZ_ENV = {
+    **os.environ,
+    'AZURE_CORE_COLLECT_TELEMETRY': 'false',
+    'AZURE_CORE_ONLY_SHOW_ERRORS': 'true',
+    'AZURE_CORE_NO_COLOR': 'true',
+    'AZURE_CORE_SURVEY_MESSAGE': 'false',
+}
+
+
+# Per-resource-group `az` calls run concurrently: each one is dominated by CLI start-up
+# and network round trips, so wall time becomes ~one call instead of one per group
+MAX_PARALLEL_AZ_CALLS = 8
+
+
+# Subscription lookups survive between runs (cron/scripted use) so the slow
+# `az account show` cold start is paid at most once per TTL
+CACHE_DIR = Path("~/.cache/webapp-demo-cost").expanduser()
+SUBSCRIPTION_CACHE_TTL_SECONDS = 12 * 60 * 60
+
+
+def _cached_subscription_id(refresh: bool = False) -> str:
+    """Current az subscription ID, read from the on-disk cache while it is fresh."""
+    cache_file = CACHE_DIR / "sub.json"
+    if not refresh:
+        try:
+            cached = json.loads(cache_file.read_text())
+            if time.time() - cached['ts'] < SUBSCRIPTION_CACHE_TTL_SECONDS:
+                return cached['id']
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    result = subprocess.run(['az', 'account', 'show', '--query', 'id', '-o', 'tsv'],
+                          capture_output=True, text=True, check=True, env=_AZ_ENV)
+    subscription_id = result.stdout.strip()
+
+    try:
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        cache_file.write_text(json.dumps({'id': subscription_id, 'ts': time.time()}))
+    except OSError:
+        pass  # Caching is best effort
+
+    return subscription_id
+
+
+# Per-resource-group costs are cached between runs: a closed period's cost never
+# changes, while the current day's still accrues and is only reused briefly
+COST_CACHE_PATH = CACHE_DIR / "costs.sqlite3"
+COST_CACHE_TTL_CLOSED_SECONDS = 12 * 60 * 60
+COST_CACHE_TTL_OPEN_SECONDS = 5 * 60
+
+
+class CostCache:
+    """SQLite-backed cache of per-resource-group costs keyed by subscription and period."""
+
+    def __init__(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(path))
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS cost_cache ("
+            "sub TEXT, rg TEXT, start TEXT, end TEXT, cost REAL, fetched_at INTEGER, ttl INTEGER, "
+            "PRIMARY KEY (sub, rg, start, end))"
+        )
+
+    def get(self, subscription_id: str, resource_groups: Sequence[str],
+            start_date: str, end_date: str) -> Optional[Dict[str, float]]:
+        """Cached cost per resource group, or None unless every group has a fresh entry."""
+        rows = self._conn.execute(
+            "SELECT rg, cost FROM cost_cache WHERE sub = ? AND start = ? AND end = ? AND fetched_at + ttl > ?",
+            (subscription_id, start_date, end_date, int(time.time()))
+        ).fetchall()
+        cached = dict(rows)
+        if not resource_groups or any(rg not in cached for rg in resource_groups):
+            return None
+        return {rg: cached[rg] for rg in resource_groups}
+
+    def put(self, subscription_id: str, costs: Dict[str, float], start_date: str, end_date: str,
+            today: str) -> None:
+        """Store costs with a TTL chosen by whether the period closed before today."""
+        ttl = COST_CACHE_TTL_CLOSED_SECONDS if end_date < today else COST_CACHE_TTL_OPEN_SECONDS
+        now = int(time.time())
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO cost_cache VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(subscription_id, rg, start_date, end_date, cost, now, ttl) for rg, cost in costs.items()]
+            )
+
+
+def _stream_az_json_items(cmd: List[str]) -> Iterator[Dict]:
+    """
+    Yield the elements of the JSON array an `az ... --output json` command prints, parsing
+    incrementally as the CLI writes them so memory stays flat for large listings.
+    Yields nothing when the command fails, like a non-zero exit on the buffered path.
+    """
+    try:
+        import ijson
+    except ImportError:
+        # Buffered fallback when ijson is not installed
+        result = subprocess.run(cmd, capture_output=True, env=_AZ_ENV)
+        if result.returncode == 0 and result.stdout.strip():
+            yield from _loads(result.stdout)
+        return
+
+    proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, env=_AZ_ENV)
+    try:
+        yield from ijson.items(proc.stdout, 'item', use_float=True)
+    except ijson.JSONError:
+        # Empty or truncated output: only an error if az itself claims success
+        if proc.wait() == 0:
+            raise
+    finally:
+        proc.stdout.close()
+        proc.wait()
+
+
+def _resource_group_of(resource_id: str) -> Optional[str]:
+    """Lower-cased resource group segment of an ARM resource ID, or None if it has none."""
+    parts = resource_id.split('/')
+    for i, part in enumerate(parts[:-1]):
+        if part.lower() == 'resourcegroups':
+            return parts[i + 1].lower()
+    return None
+
+
+def _map_resource_groups(fetch: Callable[[str], Any], resource_groups: Sequence[str]) -> List[Any]:
+    """Run fetch(rg) for every resource group concurrently; results keep the input order."""
+    with ThreadPoolExecutor(max_workers=MAX_PARALLEL_AZ_CALLS) as executor:
+        return list(executor.map(fetch, resource_groups))
+
+
+def budget_status(percentage: float) -> str:
+    """
+    'critical', 'warning' or 'ok' for spend at `percentage` of budget; cost-dashboard.sh
+    styles its budget alert with the matching alert-<status> CSS class.
+    """
+    return 'critical' if percentage >= 100 else 'warning' if percentage >= 75 else 'ok'
+
+
+# Resource cost estimates (monthly USD); read-only and shared by every estimate
+_RESOURCE_COSTS = types.MappingProxyType({
+    'Microsoft.Sql/servers': 0.0,  # Server itself is free
+    'Microsoft.Sql/servers/databases': 5.0,  # Basic tier
+    'Microsoft.Web/serverFarms': 13.0,  # B1 Basic
+    'Microsoft.Web/sites': 0.0,  # Included in App Service Plan
+    'Microsoft.ContainerRegistry/registries': 5.0,  # Basic tier
+    'Microsoft.KeyVault/vaults': 0.03,  # Per operation, minimal
+    'Microsoft.Insights/components': 2.3,  # Basic Application Insights
+    'Microsoft.OperationalInsights/workspaces': 2.3,  # Basic Log Analytics
+    'microsoft.insights/actiongroups': 0.0  # Free tier
+})
 
 
 class AzureCostMonitor:
     """Azure Cost Management client for monitoring webapp demo costs."""
     
-    def __init__(self, subscription_id: str, project_name: str = "webapp-demo"):
-        """Initialize the cost monitor with Azure credentials."""
+    def __init__(self, subscription_id: str, project_name: str = "webapp-demo", use_cli: bool = False,
+                 refresh_cache: bool = False, include_resource_details: bool = True,
+                 force_estimate: bool = False, cost_cache_path: Optional[Path] = None):
+        """
+        Initialize the cost monitor with Azure credentials.
+
+        The SDK clients are used for discovery, cost queries and resource listing; `az`
+        subprocesses (each paying CLI start-up) are only the primary path with use_cli.
+        Per-resource estimate details are skipped when include_resource_details is False.
+        force_estimate keeps the consumption and estimate fallbacks running even when Cost
+        Management answered that nothing was billed. Costs are cached in cost_cache_path,
+        COST_CACHE_PATH by default.
+        """
         self.subscription_id = subscription_id
         self.project_name = project_name
-        self.credential = DefaultAzureCredential()
+        self.use_cli = use_cli
+        self._resource_groups = None
+        self._subscription_info = None
+        self.refresh_cache = refresh_cache
+        self.include_resource_details = include_resource_details
+        self.force_estimate = force_estimate
+
+        # One clock reading per monitor: every period (and cost cache key) derives from it,
+        # so a run straddling midnight cannot mix days
+        self._now = datetime.now()
+        self._today = self._now.strftime('%Y-%m-%d')
+
+        try:
+            self._cost_cache = CostCache(cost_cache_path or COST_CACHE_PATH)
+        except (OSError, sqlite3.Error) as e:
+            print(f"Warning: Cost cache unavailable, querying Azure every run: {e}")
+            self._cost_cache = None
+
+        # The Azure SDK is imported here rather than at module level: it is by far the
+        # slowest part of start-up, and --help or a bad argument never needs it
+        try:
+            from azure.identity import AzureCliCredential, ChainedTokenCredential, ManagedIdentityCredential
+            from azure.mgmt.costmanagement import CostManagementClient
+            from azure.mgmt.resource import ResourceManagementClient
+        except ImportError as e:
+            print_error(f"Required Azure packages not installed: {e}")
+            print_status("Install with one of these methods:")
+            print_status("  1. pip install -r requirements-cost-monitoring.txt")
+            print_status("  2. pip install azure-mgmt-costmanagement azure-identity azure-mgmt-resource requests")
+            print_status("  3. ./scripts/cost-monitor.sh --install-deps")
+            sys.exit(1)
+
+        # Straight to the two sources this script is run with - Azure CLI login (PREREQUISITES)
+        # then Managed Identity - skipping the environment, workload identity, shared cache,
+        # VS Code and PowerShell probes DefaultAzureCredential walks through first
+        self.credential = ChainedTokenCredential(AzureCliCredential(), ManagedIdentityCredential())
         
         try:
             self.cost_client = CostManagementClient(self.credential)
@@ -95,38 +300,51 @@ class AzureCostMonitor:
             sys.exit(1)
     
     def get_subscription_info(self) -> Dict:
-        """Get current subscription information."""
-        try:
-            result = subprocess.run(['az', 'account', 'show'], 
-                                  capture_output=True, text=True, check=True)
-            return json.loads(result.stdout)
-        except subprocess.CalledProcessError as e:
-            print(f"Error getting subscription info: {e}")
-            return {}
+        """Get current subscription information (looked up once per monitor)."""
+        if self._subscription_info is None:
+            try:
+                result = subprocess.run(['az', 'account', 'show'], 
+                                      capture_output=True, check=True, env=_AZ_ENV)
+                self._subscription_info = _loads(result.stdout)
+            except subprocess.CalledProcessError as e:
+                print(f"Error getting subscription info: {e}")
+                return {}
+        return self._subscription_info
     
     def get_project_resource_groups(self) -> List[str]:
-        """Get all resource groups belonging to this project."""
-        resource_groups = []
+        """Get all resource groups belonging to this project (discovered once per monitor)."""
+        if self._resource_groups is None:
+            self._resource_groups = tuple(self._discover_project_resource_groups())
+        return list(self._resource_groups)
+
+    def refresh_resource_groups(self) -> List[str]:
+        """Forget the discovered resource groups and discover them again."""
+        self._resource_groups = None
+        return self.get_project_resource_groups()
+
+    def _discover_project_resource_groups(self) -> List[str]:
+        """Discover resource groups via SDK/CLI, falling back to the naming convention."""
+        discoverers = [self._discover_resource_groups_via_sdk, self._discover_resource_groups_via_cli]
+        if self.use_cli:
+            discoverers.reverse()
+
+        for discover in discoverers:
+            resource_groups = discover()
+            if resource_groups:
+                return resource_groups
 
-        try:
-            # First try to discover via Azure CLI (more reliable)
-            result = subprocess.run([
-                'az', 'group', 'list',
-                '--query', f"[?contains(name, '{self.project_name}')].name",
-                '--output', 'tsv'
-            ], capture_output=True, text=True, check=True)
+        # Final fallback to naming convention
+        print("Using fallback naming convention for resource groups")
+        resource_groups = [f"{self.project_name}-{env}-rg" for env in ['dev', 'staging', 'prod']]
+        resource_groups.append(f"{self.project_name}-terraform-state-rg")
 
-            discovered_rgs = [rg.strip() for rg in result.stdout.split('\n') if rg.strip()]
-            if discovered_rgs:
-                resource_groups.extend(discovered_rgs)
-                print(f"Discovered resource groups: {discovered_rgs}")
-                return resource_groups
+        return resource_groups
 
-        except subprocess.CalledProcessError:
-            print("Warning: Could not discover resource groups via Azure CLI")
+    def _discover_resource_groups_via_sdk(self) -> List[str]:
+        """Discover project resource groups by tag or name through the Resource Management SDK."""
+        resource_groups = []
 
         try:
-            # Fallback to Azure SDK
             for rg in self.resource_client.resource_groups.list():
                 # Check if resource group belongs to our project
                 if (rg.tags and rg.tags.get('Project') == self.project_name) or \
@@ -135,14 +353,25 @@ class AzureCostMonitor:
         except Exception as e:
             print(f"Warning: Could not list resource groups via SDK: {e}")
 
-        # Final fallback to naming convention
-        if not resource_groups:
-            print("Using fallback naming convention for resource groups")
-            for env in ['dev', 'staging', 'prod']:
-                resource_groups.append(f"{self.project_name}-{env}-rg")
-            resource_groups.append(f"{self.project_name}-terraform-state-rg")
-
         return resource_groups
+
+    def _discover_resource_groups_via_cli(self) -> List[str]:
+        """Discover project resource groups by name through the Azure CLI."""
+        try:
+            result = subprocess.run([
+                'az', 'group', 'list',
+                '--query', f"[?contains(name, '{self.project_name}')].name",
+                '--output', 'tsv'
+            ], capture_output=True, text=True, check=True, env=_AZ_ENV)
+
+            discovered_rgs = [rg.strip() for rg in result.stdout.split('\n') if rg.strip()]
+            if discovered_rgs:
+                print(f"Discovered resource groups: {discovered_rgs}")
+            return discovered_rgs
+
+        except subprocess.CalledProcessError:
+            print("Warning: Could not discover resource groups via Azure CLI")
+            return []
     
     def get_cost_data(self, days: int = 30, environment: Optional[str] = None) -> Dict:
         """Get cost data for the specified period."""
@@ -155,33 +384,36 @@ class AzureCostMonitor:
     
     def _get_cost_data_via_cli(self, days: int, environment: Optional[str] = None) -> Dict:
         """Get cost data using Azure CLI with multiple methods."""
-        end_date = datetime.now()
-        start_date = end_date - timedelta(days=days)
+        start_date_str, end_date_str = self._period(days)
 
-        start_date_str = start_date.strftime('%Y-%m-%d')
-        end_date_str = end_date.strftime('%Y-%m-%d')
+        # Get resource groups for the project, filtered to a specific environment if given;
+        # frozen once and shared read-only by every method below
+        resource_groups = tuple(rg for rg in self.get_project_resource_groups()
+                                if not environment or environment in rg)
 
-        # Get resource groups for the project
-        resource_groups = self.get_project_resource_groups()
-
-        if environment:
-            # Filter to specific environment
-            resource_groups = [rg for rg in resource_groups if environment in rg]
-
-        total_cost = 0.0
-        cost_breakdown = {}
         resource_details = {}
+        attempted_methods = ['cost_management']
+        data_source = 'actual'
 
         # Method 1: Try Cost Management API via CLI
-        total_cost, cost_breakdown = self._try_cost_management_api(start_date_str, end_date_str, resource_groups)
-
-        # Method 2: If no cost data, try consumption usage API
-        if total_cost == 0.0:
-            total_cost, cost_breakdown = self._try_consumption_api(start_date_str, end_date_str, resource_groups)
-
-        # Method 3: If still no data, get resource inventory and estimate
-        if total_cost == 0.0:
-            total_cost, cost_breakdown, resource_details = self._estimate_from_resources(resource_groups, environment)
+        total_cost, cost_breakdown, authoritative = self._try_cost_management_api(
+            start_date_str, end_date_str, resource_groups)
+
+        if total_cost == 0.0 and authoritative and not self.force_estimate:
+            # Cost Management answered and billed nothing to these groups; the fallbacks
+            # would only spend more az calls re-deriving or guessing that
+            data_source = 'authoritative_zero'
+        else:
+            # Method 2: If no cost data, try consumption usage API
+            if total_cost == 0.0:
+                attempted_methods.append('consumption')
+                total_cost, cost_breakdown = self._try_consumption_api(start_date_str, end_date_str, resource_groups)
+
+            # Method 3: If still no data, get resource inventory and estimate
+            if total_cost == 0.0:
+                attempted_methods.append('estimate')
+                total_cost, cost_breakdown, resource_details = self._estimate_from_resources(resource_groups, environment)
+                data_source = 'estimated'
 
         return {
             'total_cost': total_cost,
@@ -189,128 +421,204 @@ class AzureCostMonitor:
             'resource_details': resource_details,
             'period': f"{start_date_str} to {end_date_str}",
             'currency': 'USD',
-            'data_source': 'actual' if total_cost > 0 else 'estimated'
+            'data_source': data_source,
+            'attempted_methods': attempted_methods
         }
 
-    def _try_cost_management_api(self, start_date: str, end_date: str, resource_groups: List[str]) -> Tuple[float, Dict]:
-        """Try to get cost data using Cost Management API."""
-        total_cost = 0.0
-        cost_breakdown = {}
-
+    def _try_cost_management_api(self, start_date: str, end_date: str,
+                                 resource_groups: Sequence[str]) -> Tuple[float, Dict, bool]:
+        """
+        Try to get cost data using Cost Management API.
+
+        The period is split into its closed days and today (see _cost_slices) so the closed
+        part is cached long and only today's still-accruing slice is queried again soon.
+        The flag is True when Cost Management actually answered (or the answer was cached),
+        so a zero total means nothing was billed rather than that the query failed.
+        """
+        costs = dict.fromkeys(resource_groups, 0.0)
+
+        for slice_start, slice_end in self._cost_slices(start_date, end_date):
+            slice_costs = self._cached_costs(resource_groups, slice_start, slice_end)
+            if slice_costs is None:
+                slice_costs = self._query_costs(slice_start, slice_end, resource_groups)
+                if slice_costs is None:
+                    return 0.0, {}, False
+            for rg, cost in slice_costs.items():
+                costs[rg] += cost
+
+        cost_breakdown = {rg: cost for rg, cost in costs.items() if cost}
+        return sum(cost_breakdown.values(), 0.0), cost_breakdown, True
+
+    def _cost_slices(self, start_date: str, end_date: str) -> List[Tuple[str, str]]:
+        """[start, yesterday] and [today, end] parts of the period, leaving out empty ones."""
+        yesterday = (self._now - timedelta(days=1)).strftime('%Y-%m-%d')
+        slices = []
+        if start_date <= yesterday:
+            slices.append((start_date, min(end_date, yesterday)))
+        if end_date >= self._today:
+            slices.append((max(start_date, self._today), end_date))
+        return slices
+
+    def _query_costs(self, start_date: str, end_date: str,
+                     resource_groups: Sequence[str]) -> Optional[Dict[str, float]]:
+        """Cost per resource group queried from Cost Management and cached, or None on failure."""
         try:
-            for rg in resource_groups:
-                cost_cmd = [
-                    'az', 'costmanagement', 'query',
-                    '--type', 'ActualCost',
-                    '--dataset-aggregation', '{"totalCost":{"name":"PreTaxCost","function":"Sum"}}',
-                    '--dataset-grouping', 'name=ResourceGroup,type=Dimension',
-                    '--timeframe', 'Custom',
-                    '--time-period', f'from={start_date}T00:00:00+00:00',
-                    '--time-period', f'to={end_date}T23:59:59+00:00',
-                    '--scope', f'/subscriptions/{self.subscription_id}/resourceGroups/{rg}',
-                    '--output', 'json'
-                ]
-
-                result = subprocess.run(cost_cmd, capture_output=True, text=True)
-
-                if result.returncode == 0 and result.stdout.strip():
-                    cost_data = json.loads(result.stdout)
-                    if 'rows' in cost_data and cost_data['rows']:
-                        for row in cost_data['rows']:
-                            if len(row) >= 2:
-                                rg_cost = float(row[0])  # Cost is usually first column
-                                total_cost += rg_cost
-                                cost_breakdown[rg] = rg_cost
+            # One subscription-scoped query grouped by resource group replaces a query per group
+            query = self._cost_query_via_cli if self.use_cli else self._cost_query_via_sdk
+            response = query(start_date, end_date)
+            if response is None:
+                return None
+            columns, rows = response
+
+            cost_index = columns.index('PreTaxCost') if 'PreTaxCost' in columns else 0
+            rg_index = columns.index('ResourceGroup') if 'ResourceGroup' in columns else 1
+
+            # Cost Management reports resource group names lower-cased; groups without rows
+            # cost nothing in this period, which is cached too
+            wanted = {rg.lower(): rg for rg in resource_groups}
+            costs = dict.fromkeys(resource_groups, 0.0)
+            for row in rows:
+                if len(row) >= 2:
+                    rg = wanted.get(str(row[rg_index]).lower())
+                    if rg is not None:
+                        costs[rg] += float(row[cost_index])
 
         except Exception as e:
             print(f"Cost Management API failed: {e}")
+            return None
 
-        return total_cost, cost_breakdown
+        self._store_costs(costs, start_date, end_date)
+        return costs
 
-    def _try_consumption_api(self, start_date: str, end_date: str, resource_groups: List[str]) -> Tuple[float, Dict]:
+    def _cached_costs(self, resource_groups: Sequence[str], start_date: str, end_date: str) -> Optional[Dict[str, float]]:
+        """Fresh cached costs for every resource group, or None to query Azure."""
+        if self._cost_cache is None or self.refresh_cache:
+            return None
+        try:
+            return self._cost_cache.get(self.subscription_id, resource_groups, start_date, end_date)
+        except sqlite3.Error as e:
+            print(f"Warning: Could not read cost cache: {e}")
+            return None
+
+    def _store_costs(self, costs: Dict[str, float], start_date: str, end_date: str) -> None:
+        """Remember queried costs; caching is best effort."""
+        if self._cost_cache is None:
+            return
+        try:
+            self._cost_cache.put(self.subscription_id, costs, start_date, end_date, self._today)
+        except sqlite3.Error as e:
+            print(f"Warning: Could not write cost cache: {e}")
+
+    def _cost_query_via_sdk(self, start_date: str, end_date: str) -> Optional[Tuple[List[str], List[List]]]:
+        """Run the cost query with the Cost Management SDK, returning (column names, rows)."""
+        from azure.mgmt.costmanagement.models import (
+            QueryAggregation, QueryDataset, QueryDefinition, QueryGrouping, QueryTimePeriod
+        )
+
+        parameters = QueryDefinition(
+            type='ActualCost',
+            timeframe='Custom',
+            time_period=QueryTimePeriod(
+                from_property=datetime.fromisoformat(f'{start_date}T00:00:00+00:00'),
+                to=datetime.fromisoformat(f'{end_date}T23:59:59+00:00')
+            ),
+            dataset=QueryDataset(
+                aggregation={'totalCost': QueryAggregation(name='PreTaxCost', function='Sum')},
+                grouping=[QueryGrouping(type='Dimension', name='ResourceGroup')]
+            )
+        )
+        result = self.cost_client.query.usage(scope=f'/subscriptions/{self.subscription_id}', parameters=parameters)
+        if result is None:
+            return None
+        return [c.name for c in result.columns or []], result.rows or []
+
+    def _cost_query_via_cli(self, start_date: str, end_date: str) -> Optional[Tuple[List[str], List[List]]]:
+        """Run the cost query through `az costmanagement query`, returning (column names, rows) or None on failure."""
+        cost_cmd = [
+            'az', 'costmanagement', 'query',
+            '--type', 'ActualCost',
+            '--dataset-aggregation', '{"totalCost":{"name":"PreTaxCost","function":"Sum"}}',
+            '--dataset-grouping', 'name=ResourceGroup,type=Dimension',
+            '--timeframe', 'Custom',
+            '--time-period', f'from={start_date}T00:00:00+00:00',
+            '--time-period', f'to={end_date}T23:59:59+00:00',
+            '--scope', f'/subscriptions/{self.subscription_id}',
+            '--output', 'json'
+        ]
+
+        result = subprocess.run(cost_cmd, capture_output=True, env=_AZ_ENV)
+
+        if result.returncode != 0 or not result.stdout.strip():
+            return None
+        cost_data = _loads(result.stdout)
+        return [c.get('name') for c in cost_data.get('columns', [])], cost_data.get('rows') or []
+
+    def _try_consumption_api(self, start_date: str, end_date: str, resource_groups: Sequence[str]) -> Tuple[float, Dict]:
         """Try to get cost data using Consumption API."""
         total_cost = 0.0
         cost_breakdown = {}
 
         try:
-            for rg in resource_groups:
-                # Check if resource group exists
-                check_cmd = ['az', 'group', 'show', '--name', rg]
-                result = subprocess.run(check_cmd, capture_output=True, text=True)
-
-                if result.returncode != 0:
-                    continue
-
-                # Get consumption data
-                cost_cmd = [
-                    'az', 'consumption', 'usage', 'list',
-                    '--start-date', start_date,
-                    '--end-date', end_date,
-                    '--query', f"[?contains(instanceName, '{rg}')].{{cost:pretaxCost,service:meterCategory}}",
-                    '--output', 'json'
-                ]
-
-                result = subprocess.run(cost_cmd, capture_output=True, text=True)
-
-                if result.returncode == 0 and result.stdout.strip():
-                    usage_data = json.loads(result.stdout)
-                    rg_cost = sum(float(item.get('cost', 0)) for item in usage_data)
-                    if rg_cost > 0:
-                        total_cost += rg_cost
-                        cost_breakdown[rg] = rg_cost
+            costs = self._consumption_costs(start_date, end_date, resource_groups)
+            cost_breakdown = {rg: cost for rg, cost in costs.items() if cost > 0}
+            total_cost = sum(cost_breakdown.values(), 0.0)
 
         except Exception as e:
             print(f"Consumption API failed: {e}")
 
         return total_cost, cost_breakdown
 
-    def _estimate_from_resources(self, resource_groups: List[str], environment: Optional[str]) -> Tuple[float, Dict, Dict]:
+    def _consumption_costs(self, start_date: str, end_date: str, resource_groups: Sequence[str]) -> Dict[str, float]:
+        """
+        Consumption cost per resource group from one subscription-wide usage listing, summed
+        as rows stream in. No existence check is needed: the groups come from discovery, and
+        a group that does not exist simply has no usage rows.
+        """
+        # Only the two needed fields are projected, as TSV rows, so no JSON is produced or parsed
+        cost_cmd = [
+            'az', 'consumption', 'usage', 'list',
+            '--start-date', start_date,
+            '--end-date', end_date,
+            '--query', "[].[instanceName, pretaxCost]",
+            '--output', 'tsv'
+        ]
+        proc = subprocess.Popen(cost_cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+                                text=True, env=_AZ_ENV)
+
+        # Usage items name their resource by ARM ID: one dict lookup on its resource group
+        # segment instead of a substring scan over every group
+        wanted = {rg.lower(): rg for rg in resource_groups}
+        costs = dict.fromkeys(resource_groups, 0.0)
+        with proc:
+            for line in proc.stdout:
+                instance, _, cost = line.rstrip('\n').rpartition('\t')
+                try:
+                    item_cost = float(cost or 0)
+                except ValueError:
+                    continue  # null cost
+                rg_key = _resource_group_of(instance)
+                if rg_key is not None:
+                    rg = wanted.get(rg_key)
+                else:
+                    rg = next((rg for rg in resource_groups if rg in instance), None)
+                if rg is not None:
+                    costs[rg] += item_cost
+
+        return costs
+
+    def _estimate_from_resources(self, resource_groups: Sequence[str], environment: Optional[str]) -> Tuple[float, Dict, Dict]:
         """Estimate costs based on deployed resources."""
         total_cost = 0.0
         cost_breakdown = {}
         resource_details = {}
 
-        # Resource cost estimates (monthly USD)
-        resource_costs = {
-            'Microsoft.Sql/servers': 0.0,  # Server itself is free
-            'Microsoft.Sql/servers/databases': 5.0,  # Basic tier
-            'Microsoft.Web/serverFarms': 13.0,  # B1 Basic
-            'Microsoft.Web/sites': 0.0,  # Included in App Service Plan
-            'Microsoft.ContainerRegistry/registries': 5.0,  # Basic tier
-            'Microsoft.KeyVault/vaults': 0.03,  # Per operation, minimal
-            'Microsoft.Insights/components': 2.3,  # Basic Application Insights
-            'Microsoft.OperationalInsights/workspaces': 2.3,  # Basic Log Analytics
-            'microsoft.insights/actiongroups': 0.0  # Free tier
-        }
-
         try:
-            for rg in resource_groups:
-                # Get resources in the resource group
-                list_cmd = ['az', 'resource', 'list', '--resource-group', rg, '--output', 'json']
-                result = subprocess.run(list_cmd, capture_output=True, text=True)
-
-                if result.returncode == 0 and result.stdout.strip():
-                    resources = json.loads(result.stdout)
-                    rg_cost = 0.0
-                    rg_resources = []
-
-                    for resource in resources:
-                        resource_type = resource.get('type', '')
-                        resource_name = resource.get('name', '')
-
-                        # Estimate cost based on resource type
-                        estimated_cost = resource_costs.get(resource_type, 1.0)  # Default $1 for unknown types
-                        rg_cost += estimated_cost
-
-                        rg_resources.append({
-                            'name': resource_name,
-                            'type': resource_type,
-                            'estimated_monthly_cost': estimated_cost
-                        })
-
-                    if rg_cost > 0:
-                        total_cost += rg_cost
-                        cost_breakdown[rg] = rg_cost
+            for rg, rg_cost, rg_resources in _map_resource_groups(
+                    self._estimate_for_rg, resource_groups):
+                if rg_cost > 0:
+                    total_cost += rg_cost
+                    cost_breakdown[rg] = rg_cost
+                    if rg_resources:
                         resource_details[rg] = rg_resources
 
         except Exception as e:
@@ -325,13 +633,49 @@ class AzureCostMonitor:
 
         return total_cost, cost_breakdown, resource_details
     
+    def _estimate_for_rg(self, rg: str) -> Tuple[str, float, List[Dict]]:
+        """Estimate one resource group's monthly cost from its deployed resources."""
+        rg_resources = []
+
+        if self.include_resource_details:
+            for resource_name, resource_type in self._list_resources(rg):
+                rg_resources.append({
+                    'name': resource_name,
+                    'type': resource_type,
+                    'estimated_monthly_cost': _RESOURCE_COSTS.get(resource_type, 1.0)  # Default $1 for unknown types
+                })
+            type_counts = Counter(resource['type'] for resource in rg_resources)
+        else:
+            type_counts = Counter(resource_type for _, resource_type in self._list_resources(rg))
+
+        # Estimate cost based on resource type: one lookup per distinct type
+        rg_cost = sum(_RESOURCE_COSTS.get(resource_type, 1.0) * count for resource_type, count in type_counts.items())
+
+        return rg, rg_cost, rg_resources
+
+    def _list_resources(self, rg: str) -> Iterator[Tuple[str, str]]:
+        """Yield (name, type) for every resource in the resource group, via the SDK unless use_cli."""
+        if not self.use_cli:
+            from azure.core.exceptions import ResourceNotFoundError
+
+            try:
+                for r in self.resource_client.resources.list_by_resource_group(rg):
+                    yield r.name or '', r.type or ''
+            except ResourceNotFoundError:
+                pass  # A missing group has no resources, as on the CLI path
+            return
+
+        list_cmd = ['az', 'resource', 'list', '--resource-group', rg, '--output', 'json']
+        for r in _stream_az_json_items(list_cmd):
+            yield r.get('name', ''), r.get('type', '')
+
+    def _period(self, days: int) -> Tuple[str, str]:
+        """(start, end) dates for the last `days` days, as YYYY-MM-DD strings."""
+        return (self._now - timedelta(days=days)).strftime('%Y-%m-%d'), self._today
+
     def get_current_month_cost(self) -> Dict:
         """Get cost for the current month."""
-        now = datetime.now()
-        start_of_month = now.replace(day=1)
-        days_in_month = (now - start_of_month).days + 1
-        
-        return self.get_cost_data(days=days_in_month)
+        return self.get_cost_data(days=self._now.day)
     
     def check_budget_alerts(self, budget_limit: float, current_cost: float) -> Dict:
         """Check if costs exceed budget thresholds."""
@@ -348,61 +692,66 @@ class AzureCostMonitor:
         return {
             'percentage': percentage,
             'alerts': alerts,
-            'status': 'critical' if percentage >= 100 else 'warning' if percentage >= 75 else 'ok'
+            'status': budget_status(percentage)
         }
 
 
 def format_cost_report(cost_data: Dict, project_name: str, environment: Optional[str] = None) -> str:
     """Format cost data into a readable report."""
-    report = []
-    report.append("=" * 70)
-    report.append(f"Azure Cost Report - {project_name}")
+    buf = io.StringIO()
+    w = buf.write
+
+    w("=" * 70 + "\n")
+    w(f"Azure Cost Report - {project_name}\n")
     if environment:
-        report.append(f"Environment: {environment}")
-    report.append(f"Period: {cost_data.get('period', 'Unknown')}")
-    report.append(f"Currency: {cost_data.get('currency', 'USD')}")
-    report.append(f"Data Source: {cost_data.get('data_source', 'actual').title()}")
-    report.append("=" * 70)
+        w(f"Environment: {environment}\n")
+    w(f"Period: {cost_data.get('period', 'Unknown')}\n")
+    w(f"Currency: {cost_data.get('currency', 'USD')}\n")
+    w(f"Data Source: {cost_data.get('data_source', 'actual').replace('_', ' ').title()}\n")
+    w("=" * 70 + "\n")
 
     total_cost = cost_data.get('total_cost', 0)
-    report.append(f"Total Cost: ${total_cost:.2f}")
-    report.append("")
+    w(f"Total Cost: ${total_cost:.2f}\n")
+    w("\n")
 
     # Cost breakdown by resource group
     breakdown = cost_data.get('breakdown', {})
     if breakdown:
-        report.append("Cost Breakdown by Resource Group:")
-        report.append("-" * 50)
-        for rg, cost in sorted(breakdown.items(), key=lambda x: x[1], reverse=True):
+        w("Cost Breakdown by Resource Group:\n")
+        w("-" * 50 + "\n")
+        for rg, cost in sorted(breakdown.items(), key=operator.itemgetter(1), reverse=True):
             percentage = (cost / total_cost * 100) if total_cost > 0 else 0
-            report.append(f"{rg:<35} ${cost:>8.2f} ({percentage:>5.1f}%)")
-        report.append("")
+            w(f"{rg:<35} ${cost:>8.2f} ({percentage:>5.1f}%)\n")
+        w("\n")
 
     # Resource details if available
     resource_details = cost_data.get('resource_details', {})
     if resource_details:
-        report.append("Resource Details:")
-        report.append("-" * 50)
+        w("Resource Details:\n")
+        w("-" * 50 + "\n")
         for rg, resources in resource_details.items():
-            report.append(f"\n{rg}:")
+            w(f"\n{rg}:\n")
             for resource in resources:
                 name = resource['name'][:25] + "..." if len(resource['name']) > 25 else resource['name']
                 resource_type = resource['type'].split('/')[-1]  # Get last part of type
                 cost = resource['estimated_monthly_cost']
-                report.append(f"  {name:<28} {resource_type:<15} ${cost:>6.2f}")
-        report.append("")
+                w(f"  {name:<28} {resource_type:<15} ${cost:>6.2f}\n")
+        w("\n")
 
     # Add note about data source
     if cost_data.get('data_source') == 'estimated':
-        report.append("Note: Costs are estimated based on deployed resources.")
-        report.append("Actual billing data may take 24-48 hours to appear in Azure.")
-        report.append("Use 'az billing' commands for the most current billing data.")
-
-    return "\n".join(report)
-
-
-def main():
-    """Main function to run the cost monitor."""
+        w("Note: Costs are estimated based on deployed resources.\n")
+        w("Actual billing data may take 24-48 hours to appear in Azure.\n")
+        w("Use 'az billing' commands for the most current billing data.\n")
+    elif cost_data.get('data_source') == 'authoritative_zero':
+        w("Note: Cost Management reports no charges for this period.\n")
+        w("New deployments can take 24-48 hours to appear; use --force-estimate for an estimate.\n")
+
+    # Every line above ends in a newline; the report itself does not
+    return buf.getvalue()[:-1]
+
+def main(argv: Optional[List[str]] = None):
+    """Main function to run the cost monitor; argv defaults to the command line."""
     parser = argparse.ArgumentParser(description="Monitor Azure costs for webapp demo")
     parser.add_argument('--project-name', default='webapp-demo',
                        help='Project name for cost filtering (default: webapp-demo)')
@@ -418,14 +767,18 @@ def main():
                        help='Export results to JSON file')
     parser.add_argument('--quiet', action='store_true',
                        help='Minimal output for scripting')
+    parser.add_argument('--use-cli', action='store_true',
+                       help='Query through Azure CLI subprocesses instead of the Azure SDK')
+    parser.add_argument('--refresh-cache', action='store_true',
+                       help='Ignore cached subscription and cost lookups (e.g. after az account set)')
+    parser.add_argument('--force-estimate', action='store_true',
+                       help='Fall back to consumption data and estimates even when Cost Management reports no charges')
     
-    args = parser.parse_args()
+    args = parser.parse_args(argv)
 
     # Get subscription ID
     try:
-        result = subprocess.run(['az', 'account', 'show', '--query', 'id', '-o', 'tsv'],
-                              capture_output=True, text=True, check=True)
-        subscription_id = result.stdout.strip()
+        subscription_id = _cached_subscription_id(refresh=args.refresh_cache)
     except subprocess.CalledProcessError:
         print("Error: Could not get Azure subscription ID. Please run 'az login' first.")
         sys.exit(1)
@@ -438,7 +791,11 @@ def main():
         print()
     
     # Initialize cost monitor
-    monitor = AzureCostMonitor(subscription_id, args.project_name)
+    # Per-resource details are only shown in the report or written to an export
+    monitor = AzureCostMonitor(subscription_id, args.project_name, use_cli=args.use_cli,
+                               refresh_cache=args.refresh_cache,
+                               force_estimate=args.force_estimate,
+                               include_resource_details=not args.quiet or bool(args.export))
     
     # Get cost data
     if args.current_month:
@@ -447,9 +804,9 @@ def main():
         cost_data = monitor.get_cost_data(args.days, args.environment)
     
     # Check budget alerts
-    budget_status = None
+    budget_alerts = None
     if args.budget_alert:
-        budget_status = monitor.check_budget_alerts(args.budget_alert, cost_data.get('total_cost', 0))
+        budget_alerts = monitor.check_budget_alerts(args.budget_alert, cost_data.get('total_cost', 0))
     
     # Generate report
     if not args.quiet:
@@ -457,11 +814,11 @@ def main():
         print(report)
         
         # Show budget alerts
-        if budget_status:
+        if budget_alerts:
             print("Budget Status:")
             print("-" * 20)
-            print(f"Budget Utilization: {budget_status['percentage']:.1f}%")
-            for alert in budget_status['alerts']:
+            print(f"Budget Utilization: {budget_alerts['percentage']:.1f}%")
+            for alert in budget_alerts['alerts']:
                 print(f"ALERT: {alert}")
             print()
     else:
@@ -474,18 +831,22 @@ def main():
             'project_name': args.project_name,
             'environment': args.environment,
             'cost_data': cost_data,
-            'budget_status': budget_status,
+            'budget_status': budget_alerts,
             'generated_at': datetime.now().isoformat()
         }
         
-        with open(args.export, 'w') as f:
-            json.dump(export_data, f, indent=2)
+        if orjson is not None:
+            with open(args.export, 'wb') as f:
+                f.write(orjson.dumps(export_data, option=orjson.OPT_INDENT_2))
+        else:
+            with open(args.export, 'w') as f:
+                json.dump(export_data, f, indent=2)
         
         if not args.quiet:
             print(f"Cost data exported to: {args.export}")
     
     # Exit with error code if budget exceeded
-    if budget_status and budget_status['status'] == 'critical':
+    if budget_alerts and budget_alerts['status'] == 'critical':
         sys.exit(1)
 
 
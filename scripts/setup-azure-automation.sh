@@ -138,7 +138,8 @@ REQUIREMENTS:
     - Azure CLI authenticated with sufficient permissions
     - Contributor access to subscription for Automation Account creation
     - Python 3 support in Azure Automation (available in most regions)
-    - Python packages: azure-identity, azure-mgmt-resource, requests
+    - Python packages: azure-identity, azure-mgmt-resource, requests, aiohttp, orjson
+      (azure-storage-queue if CLEANUP_DLQ_ACCOUNT is set)
 
 EOF
 }
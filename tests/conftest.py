@@ -3,38 +3,275 @@ Pytest configuration and shared fixtures for Azure Web Application Demo tests.
 """
 
 import pytest
+import asyncio
+import contextlib
+import getpass
+import hashlib
+import importlib.util
+import io
+import json
 import os
+import stat
+import subprocess
 import sys
+import tempfile
+import time
+import traceback
+import types
 from pathlib import Path
+from unittest.mock import MagicMock, patch
 
 # Add the app directory to the Python path
 app_dir = Path(__file__).parent.parent / "app"
 sys.path.insert(0, str(app_dir))
+# Project root, so the `app` package itself is importable
+sys.path.append(str(app_dir.parent))
 
-@pytest.fixture
+# Shared by every command the tests run. Python's own descriptors are non-inheritable
+# (PEP 446), so keeping close_fds off is safe and spares the child's fd-table sweep,
+# letting subprocess use the posix_spawn fast path
+SUBPROCESS_KW = dict(capture_output=True, text=True, close_fds=False)
+
+# Subprocess results cached across pytest runs, keyed by a hash of cwd + argv + SUBPROCESS_CACHE_KEY_ENV.
+# Kept as plain JSON in a per-user directory under the temp dir that only that user can access
+SUBPROCESS_CACHE_DIR = Path(tempfile.gettempdir()) / f"webapp-demo-tests-{getpass.getuser()}"
+SUBPROCESS_CACHE_PATH = SUBPROCESS_CACHE_DIR / "subprocess.json"
+
+# Environment that changes what the cached commands report
+SUBPROCESS_CACHE_KEY_ENV = ('AZURE_SUBSCRIPTION_ID', 'AZURE_CONFIG_DIR', 'AZURE_TENANT_ID')
+
+# How long a cached result stays valid (seconds), by how quickly its data changes;
+# argv not matching any prefix is never cached. Scripts from this repo are never
+# cached, since their output changes with the code under test, and neither is anything
+# the integration tests check against live Azure
+SUBPROCESS_CACHE_TTLS = (
+    (('az', 'account', 'show'), 12 * 60 * 60),
+)
+
+def _subprocess_cache_dir_is_private():
+    """Create SUBPROCESS_CACHE_DIR if needed; False if someone else could have written to it."""
+    try:
+        SUBPROCESS_CACHE_DIR.mkdir(mode=0o700, exist_ok=True)
+        st = SUBPROCESS_CACHE_DIR.lstat()
+    except OSError:
+        return False
+    if not hasattr(os, 'getuid'):
+        return True
+    return stat.S_ISDIR(st.st_mode) and st.st_uid == os.getuid() and not st.st_mode & 0o077
+
+def _read_subprocess_cache():
+    try:
+        with open(SUBPROCESS_CACHE_PATH, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+@contextlib.contextmanager
+def _subprocess_cache_lock():
+    """Serialize the read-merge-write of every pytest process (xdist workers included)."""
+    try:
+        import fcntl
+    except ImportError:  # Windows: the atomic replace alone still never leaves a torn file
+        yield
+        return
+    with open(SUBPROCESS_CACHE_DIR / "subprocess.lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+@pytest.fixture(scope="session")
+def subprocess_cache():
+    """Subprocess results persisted in SUBPROCESS_CACHE_PATH for the session."""
+    if not _subprocess_cache_dir_is_private():
+        yield {}
+        return
+
+    cache = _read_subprocess_cache()
+    loaded = dict(cache)
+
+    yield cache
+
+    added = {k: v for k, v in cache.items() if loaded.get(k) is not v}
+    if not added:
+        return
+    now = time.time()
+    try:
+        # Merged into what other processes wrote meanwhile, then swapped in atomically
+        with _subprocess_cache_lock():
+            merged = {**_read_subprocess_cache(), **added}
+            fd, tmp_path = tempfile.mkstemp(dir=SUBPROCESS_CACHE_DIR, suffix=".tmp")
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({k: v for k, v in merged.items() if v['expires'] > now}, f)
+            os.replace(tmp_path, SUBPROCESS_CACHE_PATH)
+    except OSError:
+        pass
+
+@pytest.fixture(scope="session")
+def run_cached(subprocess_cache):
+    """
+    subprocess.run for commands without side effects, returning a cached CompletedProcess
+    when the same argv succeeded within its TTL. Commands that write files must not use it.
+    """
+    def run(argv, ttl=None, check=False):
+        argv = tuple(argv)
+        if ttl is None:
+            ttl = next((t for prefix, t in SUBPROCESS_CACHE_TTLS if argv[:len(prefix)] == prefix), 0)
+        env = tuple(f"{name}={os.environ.get(name, '')}" for name in SUBPROCESS_CACHE_KEY_ENV)
+        key = hashlib.sha256('\0'.join((os.getcwd(),) + argv + env).encode()).hexdigest()
+
+        cached = subprocess_cache.get(key)
+        if cached is not None and cached['expires'] > time.time():
+            result = subprocess.CompletedProcess(list(argv), cached['returncode'],
+                                                 cached['stdout'], cached['stderr'])
+        else:
+            result = subprocess.run(argv, **SUBPROCESS_KW)
+            # Only successes are worth replaying; a failure may be fixed by the next run
+            if ttl > 0 and result.returncode == 0:
+                subprocess_cache[key] = {'expires': time.time() + ttl, 'returncode': result.returncode,
+                                         'stdout': result.stdout, 'stderr': result.stderr}
+
+        if check:
+            result.check_returncode()
+        return result
+
+    return run
+
+async def _run_subprocess(argv):
+    """asyncio counterpart of subprocess.run(argv, **SUBPROCESS_KW)."""
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *argv, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE,
+            close_fds=SUBPROCESS_KW['close_fds'])
+    except FileNotFoundError as e:
+        # Reported like a shell would, so one missing script does not sink its siblings
+        return subprocess.CompletedProcess(argv, 127, '', str(e))
+    stdout, stderr = await proc.communicate()
+    return subprocess.CompletedProcess(argv, proc.returncode, stdout.decode(), stderr.decode())
+
+async def _gather_subprocesses(argvs):
+    return await asyncio.gather(*(_run_subprocess(argv) for argv in argvs))
+
+@pytest.fixture(scope="session")
+def run_concurrently():
+    """Run independent commands side by side, returning their CompletedProcess in order."""
+    return lambda *argvs: asyncio.run(_gather_subprocesses(argvs))
+
+COST_MONITOR_PATH = Path(__file__).parent.parent / "scripts" / "azure-cost-monitor.py"
+
+@pytest.fixture(scope="session")
+def run_cost_monitor(tmp_path_factory):
+    """
+    Run azure-cost-monitor.py's main() in this interpreter, sparing a Python start-up and
+    Azure SDK import per call. Returns a CompletedProcess like the script run as a process.
+    Its subscription and cost caches live in a session temporary directory, not the user's.
+    """
+    spec = importlib.util.spec_from_file_location("azure_cost_monitor", COST_MONITOR_PATH)
+    cost_monitor = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(cost_monitor)
+    cost_monitor.CACHE_DIR = tmp_path_factory.mktemp("cost-monitor-cache")
+    cost_monitor.COST_CACHE_PATH = cost_monitor.CACHE_DIR / "costs.sqlite3"
+
+    def run(argv):
+        stdout, stderr = io.StringIO(), io.StringIO()
+        returncode = 0
+        with contextlib.redirect_stdout(stdout), contextlib.redirect_stderr(stderr):
+            try:
+                cost_monitor.main(list(argv))
+            except SystemExit as e:
+                returncode = e.code if isinstance(e.code, int) else int(e.code is not None)
+            except Exception:
+                # What the interpreter would do with an uncaught exception
+                traceback.print_exc()
+                returncode = 1
+        return subprocess.CompletedProcess([str(COST_MONITOR_PATH), *argv], returncode,
+                                           stdout.getvalue(), stderr.getvalue())
+
+    return run
+
+# ARM batch endpoint: several GETs for the price of one az process and one HTTP call
+ARM_BATCH_URL = "https://management.azure.com/batch?api-version=2020-06-01"
+# Projects the batch response down to what the tests assert on inside az itself, so only
+# the account id/name and the project groups' name/id reach json.loads
+AZURE_CONTEXT_QUERY = (
+    "{account: {id: responses[0].content.subscriptionId, name: responses[0].content.displayName}, "
+    "resource_groups: responses[1].content.value[?contains(name, 'webapp-demo')].{name: name, id: id}}"
+)
+
+@pytest.fixture(scope="session")
+def azure_context(run_cached):
+    """
+    The test subscription and its webapp-demo resource groups, fetched with one
+    `az rest` ARM batch request. Skips when the Azure CLI is unavailable or not logged in.
+    Never replayed from the subprocess cache: the tests check these against live Azure.
+    """
+    subscription_id = os.getenv('AZURE_SUBSCRIPTION_ID')
+    if not subscription_id:
+        pytest.skip("Azure context requires AZURE_SUBSCRIPTION_ID")
+
+    subscription_url = f"/subscriptions/{subscription_id}"
+    batch = {"requests": [
+        {"httpMethod": "GET", "url": f"{subscription_url}?api-version=2020-01-01"},
+        # Already scoped to the one subscription; resource groups can only be filtered
+        # server-side by tag and ARM has no $select for them, so AZURE_CONTEXT_QUERY matches names
+        {"httpMethod": "GET", "url": f"{subscription_url}/resourcegroups?api-version=2021-04-01"},
+    ]}
+
+    try:
+        result = run_cached(['az', 'rest', '--method', 'post', '--url', ARM_BATCH_URL,
+                             '--body', json.dumps(batch), '--query', AZURE_CONTEXT_QUERY],
+                            check=True)
+        return json.loads(result.stdout)
+    except (subprocess.CalledProcessError, FileNotFoundError, ValueError):
+        pytest.skip("Azure CLI not available or not authenticated")
+
+@pytest.fixture(scope="session")
+def azure_sdk_modules():
+    """The Azure SDK modules the cost monitor depends on, imported once per session."""
+    try:
+        import azure.identity
+        import azure.mgmt.costmanagement
+        import azure.mgmt.resource
+        import requests
+    except ImportError as e:
+        pytest.fail(f"Missing required Python dependency: {e}")
+
+    return types.SimpleNamespace(identity=azure.identity, costmanagement=azure.mgmt.costmanagement,
+                                 resource=azure.mgmt.resource, requests=requests)
+
+@pytest.fixture(scope="session")
 def app():
-    """Create and configure a test instance of the Flask app."""
-    from main import create_app
-    
-    # Create app with test configuration
-    app = create_app({
-        'TESTING': True,
-        'DATABASE_URL': 'sqlite:///:memory:',  # Use in-memory SQLite for tests
-        'SECRET_KEY': 'test-secret-key'
-    })
-    
+    """Create and configure one test instance of the Flask app, shared by the session."""
+    # Imported as the app package: main's relative imports need it, and the DB fixtures
+    # patch the same app.db module the routes use
+    from app.main import create_app
+
+    app = create_app()
+    # Unhandled errors get the production 500 page rather than being raised into the test,
+    # so the security tests see what a client would
+    app.config.update(TESTING=True, PROPAGATE_EXCEPTIONS=False)
+
     return app
 
+@pytest.fixture(scope="session")
+def _session_client(app):
+    # Cookies off: nothing carries over between the tests sharing this client
+    return app.test_client(use_cookies=False)
+
 @pytest.fixture
-def client(app):
-    """Create a test client for the Flask app."""
-    return app.test_client()
+def client(app, _session_client):
+    """The session's Flask test client, in an app context torn down after each test."""
+    with app.app_context():
+        yield _session_client
 
 @pytest.fixture
 def runner(app):
     """Create a test runner for the Flask app."""
     return app.test_cli_runner()
 
+@pytest.fixture(scope="session")
+def env_snapshot():
+    """The environment as the session started, read with plain dict lookups."""
+    return dict(os.environ)
+
 @pytest.fixture
 def mock_azure_credentials():
     """Mock Azure credentials for testing."""
@@ -60,42 +297,105 @@ def sample_quotes():
         }
     ]
 
+@pytest.fixture(scope="class")
+def _class_db_pool():
+    # The routes reach the database through app.db's pool: acquire_connection() hands out
+    # an idle pooled connection, or opens one with get_db_connection() when there is none
+    from app import db
+    with patch.object(db, 'get_db_connection') as get_db_connection, \
+         patch.object(db, '_POOL', db.queue.Queue(maxsize=1)) as pool, \
+         patch.object(db, '_start_pool_health_check'):
+        yield get_db_connection, pool
+
 @pytest.fixture
-def mock_database_connection():
-    """Mock database connection for testing."""
-    class MockConnection:
-        def __init__(self):
-            self.closed = False
-            
-        def cursor(self):
-            return MockCursor()
-            
-        def close(self):
-            self.closed = True
-            
-        def commit(self):
-            pass
-    
-    class MockCursor:
-        def __init__(self):
+def get_db_connection(_class_db_pool):
+    """
+    app.db.get_db_connection, patched once per test class and reset for every test. The
+    routes' pool is emptied first, so a test's first request connects through it.
+    """
+    get_db_connection, pool = _class_db_pool
+    while not pool.empty():
+        pool.get_nowait()
+    get_db_connection.reset_mock(return_value=True, side_effect=True)
+    return get_db_connection
+
+# Row the patched_db cursor returns unless a test says otherwise
+PATCHED_DB_ROW = (1, "A", "Q")
+
+@pytest.fixture(scope="class")
+def _class_db_connection():
+    connection = MagicMock()
+    connection.cursor.return_value = MagicMock()
+    return connection
+
+@pytest.fixture
+def patched_db(get_db_connection, _class_db_connection, monkeypatch):
+    """
+    (get_db_connection, connection, cursor) mocks behind the pool the routes acquire their
+    connection from. They are built once per test class and reset for every test, the
+    cursor returning PATCHED_DB_ROW; a test only sets the behaviour it needs to differ.
+    """
+    from app import db, main
+
+    # The process-wide results the routes cache from their first query start cold, except
+    # a one-id quote range, so fetch_random_quote runs its seek on this cursor straight away
+    monkeypatch.setattr(db, '_QUOTE_ID_RANGE', (1, 1))
+    monkeypatch.setattr(db, '_QUOTE_ID_RANGE_EXPIRES', float('inf'))
+    monkeypatch.setattr(db, '_DB_IDENTITY', None)
+    monkeypatch.setitem(main._VALIDATION_CACHE, 'data', None)
+
+    connection = _class_db_connection
+    cursor = connection.cursor.return_value
+    connection.reset_mock(side_effect=True)
+    cursor.reset_mock(return_value=True, side_effect=True)
+    cursor.fetchone.return_value = PATCHED_DB_ROW
+    get_db_connection.return_value = connection
+    return get_db_connection, connection, cursor
+
+@pytest.fixture
+def mock_db(patched_db):
+    """The cursor of the mock connection the routes get from the patched pool."""
+    return patched_db[2]
+
+class MockConnection:
+    def __init__(self):
+        self.closed = False
+        
+    def cursor(self):
+        return MockCursor()
+        
+    def close(self):
+        self.closed = True
+        
+    def commit(self):
+        pass
+
+class MockCursor:
+    def __init__(self):
+        self.results = []
+        
+    def execute(self, query, params=None):
+        # Mock different query responses
+        if "SELECT COUNT(1)" in query:
+            self.results = [(5,)]  # Mock count
+        elif "SELECT TOP 1" in query:
+            self.results = [(1, "Test Author", "Test quote text")]
+        else:
             self.results = []
             
-        def execute(self, query, params=None):
-            # Mock different query responses
-            if "SELECT COUNT(1)" in query:
-                self.results = [(5,)]  # Mock count
-            elif "SELECT TOP 1" in query:
-                self.results = [(1, "Test Author", "Test quote text")]
-            else:
-                self.results = []
-                
-        def fetchone(self):
-            return self.results[0] if self.results else None
-            
-        def fetchall(self):
-            return self.results
-            
-        def close(self):
-            pass
-    
+    def fetchone(self):
+        return self.results[0] if self.results else None
+        
+    def fetchall(self):
+        return self.results
+        
+    def close(self):
+        pass
+
+@pytest.fixture(scope="module")
+def mock_database_connection():
+    """
+    Mock database connection for testing, shared by a test module: every cursor() is a
+    fresh MockCursor, so no query results carry over between tests.
+    """
     return MockConnection()
@@ -3,7 +3,6 @@ Integration tests for database connectivity and operations.
 """
 
 import pytest
-import json
 import os
 from unittest.mock import patch, MagicMock
 
@@ -17,7 +16,7 @@ class TestDatabaseIntegration:
     )
     def test_real_database_connection(self):
         """Test actual database connection (requires real Azure SQL)."""
-        from main import get_db_connection
+        from app.db import get_db_connection
         
         connection = get_db_connection()
         if connection:
@@ -28,121 +27,96 @@ class TestDatabaseIntegration:
             cursor.close()
             connection.close()
     
-    def test_database_schema_validation(self, client):
+    def test_database_schema_validation(self, client, mock_db):
         """Test that database schema is properly set up."""
-        with patch('main.get_db_connection') as mock_db:
-            # Mock a connection that returns schema info
-            mock_connection = MagicMock()
-            mock_cursor = MagicMock()
-            
-            # Mock schema check query
-            mock_cursor.execute.return_value = None
-            mock_cursor.fetchall.return_value = [
-                ('quotes', 'id', 'int'),
-                ('quotes', 'author', 'nvarchar'),
-                ('quotes', 'text', 'nvarchar')
+        # Mock schema check query (the last of the validation batch's result sets)
+        mock_db.fetchall.side_effect = [
+            [],  # Sample quotes
+            [
+                ('id', 'int', None),
+                ('author', 'nvarchar', 255),
+                ('text', 'nvarchar', 2000)
             ]
-            
-            mock_connection.cursor.return_value = mock_cursor
-            mock_db.return_value = mock_connection
-            
-            # Test schema validation endpoint
-            response = client.get('/db-validate')
-            assert response.status_code == 200
-            
-            data = json.loads(response.data)
-            assert 'database_status' in data
+        ]
+
+        # Test schema validation endpoint
+        response = client.get('/db-validate')
+        assert response.status_code == 200
+
+        data = response.get_json()
+        schema = data['database_validation']['table_schema']
+        assert [column['column'] for column in schema] == ['id', 'author', 'text']
     
-    def test_quote_data_integrity(self, client):
+    def test_quote_data_integrity(self, client, mock_db):
         """Test that quote data maintains integrity."""
-        with patch('main.get_db_connection') as mock_db:
-            mock_connection = MagicMock()
-            mock_cursor = MagicMock()
-            
-            # Mock quote data with proper structure
-            mock_cursor.fetchone.return_value = (1, "Test Author", "Test quote with proper content")
-            mock_connection.cursor.return_value = mock_cursor
-            mock_db.return_value = mock_connection
-            
-            response = client.get('/')
-            assert response.status_code == 200
-            
-            data = json.loads(response.data)
-            assert isinstance(data['id'], int)
-            assert isinstance(data['author'], str)
-            assert isinstance(data['text'], str)
-            assert len(data['text']) > 0
+        # Mock quote data with proper structure
+        mock_db.fetchone.return_value = (1, "Test Author", "Test quote with proper content")
+
+        response = client.get('/')
+        assert response.status_code == 200
+
+        data = response.get_json()
+        assert isinstance(data['id'], int)
+        assert isinstance(data['author'], str)
+        assert isinstance(data['text'], str)
+        assert len(data['text']) > 0
     
-    def test_database_seeding_verification(self, client):
+    def test_database_seeding_verification(self, client, mock_db):
         """Test that database seeding worked correctly."""
-        with patch('main.get_db_connection') as mock_db:
-            mock_connection = MagicMock()
-            mock_cursor = MagicMock()
-            
-            # Mock count query to verify seeding
-            mock_cursor.fetchone.return_value = (42,)  # Mock quote count
-            mock_connection.cursor.return_value = mock_cursor
-            mock_db.return_value = mock_connection
-            
-            response = client.get('/db-test')
-            assert response.status_code == 200
-            
-            data = json.loads(response.data)
-            assert data['quote_count'] > 0
+        # Mock count query to verify seeding
+        mock_db.fetchone.side_effect = [
+            ("test-server", "test-db", "Microsoft SQL Server 2022"),
+            (42,)  # Mock quote count
+        ]
+
+        response = client.get('/db-validate')
+        assert response.status_code == 200
+
+        data = response.get_json()
+        assert data['database_validation']['total_quotes'] > 0
     
-    def test_connection_pooling_behavior(self):
+    def test_connection_pooling_behavior(self, client, patched_db):
         """Test database connection pooling and cleanup."""
-        from main import get_db_connection
-        
-        with patch('main.pyodbc.connect') as mock_connect:
-            mock_connection = MagicMock()
-            mock_connect.return_value = mock_connection
-            
-            # Test multiple connections
-            conn1 = get_db_connection()
-            conn2 = get_db_connection()
-            
-            # Both should be valid connections
-            assert conn1 is not None
-            assert conn2 is not None
+        get_db_connection, connection, _ = patched_db
+
+        # Test multiple requests
+        assert client.get('/').status_code == 200
+        assert client.get('/').status_code == 200
+
+        # The second request reuses the connection the first returned to the pool
+        get_db_connection.assert_called_once()
+        connection.rollback.assert_called()
+        connection.close.assert_not_called()
     
-    def test_database_error_handling(self, client):
+    def test_database_error_handling(self, client, get_db_connection):
         """Test proper error handling for database failures."""
-        with patch('main.get_db_connection') as mock_db:
-            # Simulate database connection failure
-            mock_db.return_value = None
-            
-            response = client.get('/')
-            assert response.status_code == 500
-            
-            data = json.loads(response.data)
-            assert 'error' in data
-            assert data['status'] == 'error'
+        # Simulate database connection failure
+        get_db_connection.side_effect = Exception("Communication link failure")
+
+        response = client.get('/')
+        assert response.status_code == 503
+
+        data = response.get_json()
+        assert data == {'error': 'database_unavailable'}
     
-    def test_sql_injection_protection(self, client):
+    def test_sql_injection_protection(self, client, mock_db):
         """Test that the application is protected against SQL injection."""
-        with patch('main.get_db_connection') as mock_db:
-            mock_connection = MagicMock()
-            mock_cursor = MagicMock()
-            
-            # Mock normal quote response
-            mock_cursor.fetchone.return_value = (1, "Safe Author", "Safe quote text")
-            mock_connection.cursor.return_value = mock_cursor
-            mock_db.return_value = mock_connection
-            
-            # Test normal request
-            response = client.get('/')
-            assert response.status_code == 200
-            
-            # Verify that parameterized queries are used
-            # (This is more of a code review item, but we can check the mock calls)
-            mock_cursor.execute.assert_called()
-            call_args = mock_cursor.execute.call_args
-            
-            # Ensure no direct string concatenation in SQL
-            if call_args and len(call_args[0]) > 0:
-                sql_query = call_args[0][0]
-                assert "'" not in sql_query or "?" in sql_query  # Parameterized queries
+        # Mock normal quote response
+        mock_db.fetchone.return_value = (1, "Safe Author", "Safe quote text")
+
+        # Test normal request
+        response = client.get('/')
+        assert response.status_code == 200
+
+        # Verify that parameterized queries are used
+        # (This is more of a code review item, but we can check the mock calls)
+        mock_db.execute.assert_called()
+        call_args = mock_db.execute.call_args
+
+        # Ensure no direct string concatenation in SQL
+        if call_args and len(call_args[0]) > 0:
+            sql_query = call_args[0][0]
+            assert "'" not in sql_query or "?" in sql_query  # Parameterized queries
 
 
 class TestAzureIntegration:
@@ -152,21 +126,10 @@ class TestAzureIntegration:
         not os.getenv('AZURE_CLIENT_ID'),
         reason="Azure integration tests require Azure credentials"
     )
-    def test_key_vault_integration(self):
-        """Test Key Vault integration for secrets."""
-        # This would test actual Key Vault connectivity
-        # Skipped if no Azure credentials available
-        pass
-    
-    @pytest.mark.skipif(
-        not os.getenv('AZURE_CLIENT_ID'),
-        reason="Azure integration tests require Azure credentials"
-    )
-    def test_application_insights_integration(self):
-        """Test Application Insights telemetry."""
-        # This would test actual Application Insights connectivity
-        # Skipped if no Azure credentials available
-        pass
+    @pytest.mark.parametrize('svc', ['keyvault', 'appinsights'])
+    def test_azure_svc_stub(self, svc):
+        """Placeholder for Key Vault secrets and Application Insights telemetry connectivity."""
+        pytest.skip(f"{svc} connectivity test not implemented")
     
     def test_container_registry_access(self):
         """Test Azure Container Registry access."""
@@ -181,7 +144,7 @@ class TestAzureIntegration:
     def test_app_service_deployment_validation(self, client):
         """Test that the app is properly deployed to App Service."""
         # Test health endpoints that would be available in App Service
-        response = client.get('/health')
+        response = client.get('/healthz')
         assert response.status_code == 200
         
         # Test that environment variables are properly configured
@@ -195,61 +158,54 @@ class TestAzureIntegration:
 
 class TestEndToEndWorkflow:
     """End-to-end integration tests."""
+
+    # Mock validation responses
+    _VALIDATION_SIDE_EFFECTS = (
+        ("test-server", "test-db", "Microsoft SQL Server 2022"),  # Server info
+        (25,)  # Quote count
+    )
+    _VALIDATION_ROWS = (
+        [(1, "Test Author")],  # Sample quotes
+        [("id", "int", None)]  # Schema
+    )
     
-    def test_complete_quote_retrieval_workflow(self, client):
+    def test_complete_quote_retrieval_workflow(self, client, mock_db):
         """Test the complete workflow from request to response."""
-        with patch('main.get_db_connection') as mock_db:
-            mock_connection = MagicMock()
-            mock_cursor = MagicMock()
-            
-            # Mock the complete workflow
-            mock_cursor.fetchone.return_value = (1, "Integration Test Author", "This is an integration test quote")
-            mock_connection.cursor.return_value = mock_cursor
-            mock_db.return_value = mock_connection
-            
-            # Test the complete workflow
-            response = client.get('/')
-            assert response.status_code == 200
-            
-            data = json.loads(response.data)
-            assert data['id'] == 1
-            assert data['author'] == "Integration Test Author"
-            assert "integration test" in data['text'].lower()
+        # Mock the complete workflow
+        mock_db.fetchone.return_value = (1, "Integration Test Author", "This is an integration test quote")
+
+        # Test the complete workflow
+        response = client.get('/')
+        assert response.status_code == 200
+
+        data = response.get_json()
+        assert data['id'] == 1
+        assert data['author'] == "Integration Test Author"
+        assert "integration test" in data['text'].lower()
     
-    def test_database_validation_workflow(self, client):
+    def test_database_validation_workflow(self, client, mock_db):
         """Test the complete database validation workflow."""
-        with patch('main.get_db_connection') as mock_db:
-            mock_connection = MagicMock()
-            mock_cursor = MagicMock()
-            
-            # Mock validation responses
-            mock_cursor.fetchone.side_effect = [
-                (25,),  # Quote count
-                (1, "Test Author", "Test quote")  # Sample quote
-            ]
-            mock_connection.cursor.return_value = mock_cursor
-            mock_db.return_value = mock_connection
-            
-            # Test validation endpoint
-            response = client.get('/db-validate')
-            assert response.status_code == 200
-            
-            data = json.loads(response.data)
-            assert data['quote_count'] == 25
-            assert 'sample_quote' in data
+        mock_db.fetchone.side_effect = iter(self._VALIDATION_SIDE_EFFECTS)
+        mock_db.fetchall.side_effect = iter(self._VALIDATION_ROWS)
+
+        # Test validation endpoint
+        response = client.get('/db-validate')
+        assert response.status_code == 200
+
+        data = response.get_json()
+        assert data['database_validation']['total_quotes'] == 25
+        assert data['database_validation']['sample_quotes'] == [{"id": 1, "author": "Test Author"}]
     
-    def test_error_recovery_workflow(self, client):
+    def test_error_recovery_workflow(self, client, get_db_connection):
         """Test error recovery and graceful degradation."""
-        with patch('main.get_db_connection') as mock_db:
-            # Test database failure recovery
-            mock_db.side_effect = Exception("Database temporarily unavailable")
-            
-            response = client.get('/')
-            assert response.status_code == 500
-            
-            data = json.loads(response.data)
-            assert 'error' in data
-            assert data['status'] == 'error'
-            
-            # Test that the application doesn't crash
-            assert response.data is not None
+        # Test database failure recovery
+        get_db_connection.side_effect = Exception("Database temporarily unavailable")
+
+        response = client.get('/')
+        assert response.status_code == 503
+
+        data = response.get_json()
+        assert data == {'error': 'database_unavailable'}
+
+        # Test that the application doesn't crash
+        assert response.data is not None
@@ -4,9 +4,11 @@ Unit tests for the Flask application core functionality.
 
 import pytest
 import json
+from datetime import datetime
 from unittest.mock import patch, MagicMock
 
 
+@pytest.mark.xdist_group(name="TestFlaskApp")
 class TestFlaskApp:
     """Test cases for Flask application routes and functionality."""
     
@@ -17,160 +19,431 @@ class TestFlaskApp:
     
     def test_health_check(self, client):
         """Test the basic health check endpoint."""
-        with patch('main.get_db_connection') as mock_db:
-            mock_db.return_value = None
-            response = client.get('/health')
-            assert response.status_code == 200
+        response = client.get('/healthz')
+        assert response.status_code == 200
+        assert response.get_json() == {"status": "ok"}
+    
+    def test_json_datetime_matches_flask(self, app):
+        """Test that the orjson provider keeps Flask's HTTP-date format for datetimes."""
+        from flask.json.provider import DefaultJSONProvider
+        
+        data = {"created": datetime(2024, 1, 2, 3, 4, 5), "id": 1}
+        
+        assert json.loads(app.json.dumps(data)) == json.loads(DefaultJSONProvider(app).dumps(data))
+        assert json.loads(app.json.dumps(data))["created"] == "Tue, 02 Jan 2024 03:04:05 GMT"
     
-    @patch('main.get_db_connection')
-    def test_home_route_success(self, mock_db, client, mock_database_connection):
+    def test_debug_seed_reports_clean_seed(self, client, tmp_path, monkeypatch):
+        """Test that /debug-seed reads the comment-free seed file the loader prefers."""
+        from app import main
+        
+        clean_path = tmp_path / "quotes.clean.json"
+        clean_path.write_text(json.dumps([{"author": "A", "text": "T"}]))
+        monkeypatch.setattr(main, '_resolve_seed_path', lambda: (clean_path, True))
+        monkeypatch.setattr(main, '_DEBUG_SEED_CACHE', {"expires": 0.0, "loaded": False, "data": None})
+        
+        with patch('app.db._load_quotes_securely', return_value=None):
+            response = client.get('/debug-seed')
+        
+        assert response.status_code == 200
+        data_loading_test = response.get_json()["data_loading_test"]
+        assert data_loading_test["path"] == str(clean_path)
+        assert data_loading_test["is_clean"] is True
+        assert data_loading_test["quote_items"] == 1
+        assert data_loading_test["first_quote"] == {"author": "A", "text": "T"}
+    
+    def test_home_route_success(self, client, patched_db, mock_database_connection):
         """Test successful quote retrieval from home route."""
+        mock_db, _, _ = patched_db
         mock_db.return_value = mock_database_connection
         
         response = client.get('/')
         assert response.status_code == 200
         
-        data = json.loads(response.data)
+        data = response.get_json()
         assert 'id' in data
         assert 'author' in data
         assert 'text' in data
     
-    @patch('main.get_db_connection')
-    def test_home_route_db_error(self, mock_db, client):
+    def test_home_route_db_error(self, client, patched_db):
         """Test home route when database connection fails."""
+        mock_db, _, _ = patched_db
         mock_db.side_effect = Exception("Database connection failed")
         
         response = client.get('/')
-        assert response.status_code == 500
+        assert response.status_code == 503
         
-        data = json.loads(response.data)
-        assert 'error' in data
+        data = response.get_json()
+        assert data == {'error': 'database_unavailable'}
     
-    @patch('main.get_db_connection')
-    def test_db_test_route(self, mock_db, client, mock_database_connection):
+    def test_db_test_route(self, client, mock_db):
         """Test the database test endpoint."""
-        mock_db.return_value = mock_database_connection
+        mock_db.fetchone.return_value = ("Microsoft SQL Server 2022 (RTM)",)
         
         response = client.get('/db-test')
         assert response.status_code == 200
         
-        data = json.loads(response.data)
-        assert 'status' in data
-        assert 'quote_count' in data
+        data = response.get_json()
+        assert data['status'] == 'success'
+        assert data['database'] == 'connected'
+        assert data['version'] == "Microsoft SQL Server 2022 (RTM)"
     
-    @patch('main.get_db_connection')
-    def test_db_validate_route(self, mock_db, client, mock_database_connection):
+    def test_db_validate_route(self, client, mock_db):
         """Test the database validation endpoint."""
-        mock_db.return_value = mock_database_connection
+        # One batch, four result sets: server info, quote count, sample quotes, schema
+        mock_db.fetchone.side_effect = [("test-server", "test-db", "Microsoft SQL Server 2022"), (5,)]
+        mock_db.fetchall.side_effect = [[(1, "Test Author")], [("id", "int", None), ("author", "nvarchar", 255)]]
         
         response = client.get('/db-validate')
         assert response.status_code == 200
         
-        data = json.loads(response.data)
-        assert 'database_status' in data
-        assert 'quote_count' in data
+        data = response.get_json()
+        assert data['status'] == 'success'
+        validation = data['database_validation']
+        assert validation['server_name'] == "test-server"
+        assert validation['total_quotes'] == 5
+        assert validation['sample_quotes'] == [{"id": 1, "author": "Test Author"}]
+        assert [column['column'] for column in validation['table_schema']] == ["id", "author"]
     
-    @patch('main.get_db_connection')
-    def test_quote_with_source_route(self, mock_db, client, mock_database_connection):
+    def test_quote_with_source_route(self, client, mock_db):
         """Test the quote with source endpoint."""
-        mock_db.return_value = mock_database_connection
+        mock_db.fetchone.side_effect = [
+            ("test-server", "test-db"),  # Server identity
+            (1, "Test Author", "Test quote text", datetime(2024, 1, 1, 12, 0))
+        ]
         
         response = client.get('/quote-with-source')
         assert response.status_code == 200
         
-        data = json.loads(response.data)
-        assert 'quote' in data
-        assert 'source_info' in data
+        data = response.get_json()
+        assert data['quote'] == {"id": 1, "author": "Test Author", "text": "Test quote text"}
+        assert data['source_validation']['server_name'] == "test-server"
+        assert data['source_validation']['query_time'] == "2024-01-01T12:00:00"
 
 
+@pytest.mark.xdist_group(name="TestDatabaseFunctions")
 class TestDatabaseFunctions:
     """Test cases for database-related functions."""
     
-    @patch('main.pyodbc.connect')
-    def test_get_db_connection_success(self, mock_connect):
+    @pytest.fixture
+    def db_env(self, monkeypatch):
+        """
+        The db module with discrete SQL_* settings in its import-time environment snapshot,
+        and no connection string cached or connection attempts disabled.
+        """
+        import db
+
+        monkeypatch.setattr(db._ENV, 'conn_str', None)
+        monkeypatch.setattr(db._ENV, 'sql_server', 'test-server')
+        monkeypatch.setattr(db._ENV, 'sql_database', 'test-db')
+        monkeypatch.setattr(db._ENV, 'sql_user', 'test-user')
+        monkeypatch.setattr(db._ENV, 'sql_password', 'test-pass')
+        monkeypatch.setattr(db, '_CACHED_CONN_STR', None)
+        monkeypatch.setattr(db, '_DB_DISABLED', None)
+        return db
+    
+    def test_get_db_connection_success(self, monkeypatch, db_env):
         """Test successful database connection."""
-        from main import get_db_connection
-        
         mock_connection = MagicMock()
-        mock_connect.return_value = mock_connection
-        
-        # Mock environment variables
-        with patch.dict('os.environ', {
-            'DATABASE_SERVER': 'test-server',
-            'DATABASE_NAME': 'test-db',
-            'DATABASE_USERNAME': 'test-user',
-            'DATABASE_PASSWORD': 'test-pass'
-        }):
-            connection = get_db_connection()
-            assert connection == mock_connection
+        mock_pyodbc = MagicMock()
+        mock_pyodbc.connect.return_value = mock_connection
+        monkeypatch.setattr(db_env, '_load_pyodbc', lambda: mock_pyodbc)
+        
+        connection = db_env.get_db_connection()
+        assert connection is mock_connection
+        
+        conn_str = mock_pyodbc.connect.call_args[0][0]
+        assert "Server=tcp:test-server,1433;Database=test-db;" in conn_str
+        assert "Encrypt=yes" in conn_str
     
-    @patch('main.pyodbc.connect')
-    def test_get_db_connection_failure(self, mock_connect):
+    def test_get_db_connection_failure(self, monkeypatch, db_env):
         """Test database connection failure."""
-        from main import get_db_connection
-        
-        mock_connect.side_effect = Exception("Connection failed")
-        
-        with patch.dict('os.environ', {
-            'DATABASE_SERVER': 'test-server',
-            'DATABASE_NAME': 'test-db',
-            'DATABASE_USERNAME': 'test-user',
-            'DATABASE_PASSWORD': 'test-pass'
-        }):
-            connection = get_db_connection()
-            assert connection is None
+        mock_pyodbc = MagicMock()
+        mock_pyodbc.connect.side_effect = Exception("Connection failed")
+        monkeypatch.setattr(db_env, '_load_pyodbc', lambda: mock_pyodbc)
+        
+        with pytest.raises(Exception, match="Connection failed"):
+            db_env.get_db_connection()
     
-    def test_get_random_quote_success(self, mock_database_connection):
-        """Test successful quote retrieval."""
-        from main import get_random_quote
-        
-        quote = get_random_quote(mock_database_connection)
-        assert quote is not None
-        assert 'id' in quote
-        assert 'author' in quote
-        assert 'text' in quote
+    def test_fetch_random_quote_success(self, mock_database_connection):
+        """Test successful quote retrieval from an empty id range cache."""
+        import db
+        
+        with patch.object(db, '_QUOTE_ID_RANGE', None):
+            quote = db.fetch_random_quote(mock_database_connection.cursor())
+        
+        assert quote == (1, "Test Author", "Test quote text")
     
-    def test_get_random_quote_failure(self):
-        """Test quote retrieval with database error."""
-        from main import get_random_quote
+    def test_fetch_random_quote_failure(self):
+        """Test that a query error reaches the caller instead of being swallowed."""
+        import db
         
-        mock_connection = MagicMock()
         mock_cursor = MagicMock()
         mock_cursor.execute.side_effect = Exception("Query failed")
-        mock_connection.cursor.return_value = mock_cursor
         
-        quote = get_random_quote(mock_connection)
-        assert quote is None
+        with patch.object(db, '_QUOTE_ID_RANGE', (1, 5)), \
+             patch.object(db, '_QUOTE_ID_RANGE_EXPIRES', float('inf')), \
+             pytest.raises(Exception, match="Query failed"):
+            db.fetch_random_quote(mock_cursor)
 
 
-class TestUtilityFunctions:
-    """Test cases for utility functions."""
-    
-    def test_format_quote_response(self):
-        """Test quote response formatting."""
-        from main import format_quote_response
-        
-        quote_data = (1, "Test Author", "Test quote text")
-        formatted = format_quote_response(quote_data)
-        
-        assert formatted['id'] == 1
-        assert formatted['author'] == "Test Author"
-        assert formatted['text'] == "Test quote text"
-    
-    def test_format_quote_response_none(self):
-        """Test quote response formatting with None input."""
-        from main import format_quote_response
-        
-        formatted = format_quote_response(None)
-        assert formatted is None
-    
-    def test_error_response_format(self):
-        """Test error response formatting."""
-        from main import create_error_response
-        
-        error_response = create_error_response("Test error message", 500)
-        
-        assert error_response[1] == 500  # Status code
-        data = json.loads(error_response[0].data)
-        assert data['error'] == "Test error message"
-        assert data['status'] == 'error'
+@pytest.mark.xdist_group(name="TestQuoteLoading")
+class TestQuoteLoading:
+    """Test cases for secure quote loading in the db module."""
+
+    def test_load_quotes_securely_is_memoized(self):
+        """Test that quotes are computed once and reused."""
+        import db
+
+        with patch.object(db, '_LOADED_QUOTES', None), \
+             patch.object(db, '_QUOTE_LOADER', return_value=[{"author": "A", "text": "T"}]) as mock_loader:
+            first = db._load_quotes_securely()
+            second = db._load_quotes_securely()
+
+        assert first == [{"author": "A", "text": "T"}]
+        assert second is first
+        mock_loader.assert_called_once()
+
+    def test_load_quotes_securely_retries_failed_load(self):
+        """Test that a failed load is not cached, so the next call tries again."""
+        import db
+
+        quotes = [{"author": "A", "text": "T"}]
+        with patch.object(db, '_LOADED_QUOTES', None), \
+             patch.object(db, '_QUOTE_LOADER', side_effect=[Exception("Key Vault unavailable"), quotes]) as mock_loader:
+            first = db._load_quotes_securely()
+            second = db._load_quotes_securely()
+
+        assert first is None
+        assert second == quotes
+        assert mock_loader.call_count == 2
+
+    def test_select_quote_loader_demo_mode_uses_seed_files(self):
+        """Test that DEMO_MODE selects the seed file loader."""
+        import db
+
+        with patch.object(db._ENV, 'demo_mode', True), \
+             patch.object(db._ENV, 'environment', 'dev'):
+            assert db._select_quote_loader() is db._load_from_seed_files
+
+    def test_select_quote_loader_prod_requires_key_vault(self):
+        """Test that production without KEY_VAULT_URL never falls back to seed files."""
+        import db
+
+        with patch.object(db._ENV, 'environment', 'prod'), \
+             patch.object(db._ENV, 'key_vault_url', None), \
+             patch.object(db._ENV, 'demo_mode', True):
+            loader = db._select_quote_loader()
+
+        assert loader is db._load_unavailable
+        assert loader() is None
+
+    def test_seed_candidates_skip_outdated_clean_seed(self, tmp_path):
+        """Test that a clean seed older than an edited quotes.json is not preferred."""
+        import os
+        import db
+
+        source = tmp_path / "quotes.json"
+        clean = tmp_path / db.CLEAN_SEED_NAME
+        source.write_text("[]")
+        clean.write_text("[]")
+
+        with patch.object(db, '_POSSIBLE_SEED_PATHS', (source,)):
+            os.utime(source, (1000, 1000))
+            os.utime(clean, (2000, 2000))
+            assert db._seed_candidates() == ((clean, True), (source, False))
+
+            os.utime(source, (3000, 3000))
+            assert db._seed_candidates() == ((source, False),)
+
+    def test_load_from_seed_files_falls_through_on_parse_error(self, tmp_path):
+        """Test that an unreadable clean seed falls back to the source quotes.json."""
+        import db
+
+        clean = tmp_path / db.CLEAN_SEED_NAME
+        source = tmp_path / "quotes.json"
+        clean.write_text("[{truncated")
+        source.write_text(json.dumps([{"_comment": "docs"}, {"author": "A", "text": "T"}]))
+
+        with patch.object(db, '_SEED_CANDIDATES', ((clean, True), (source, False))):
+            assert db._load_from_seed_files() == [{"author": "A", "text": "T"}]
+
+    def test_decode_quotes_payload_reuses_parsed_data(self):
+        """Test that an unchanged base64 payload is parsed only once."""
+        import base64
+        import db
+
+        payload = base64.b64encode(json.dumps([{"author": "A", "text": "T"}]).encode()).decode()
+
+        with patch.object(db, '_QUOTES_CACHE', {"src_hash": None, "data": None}), \
+             patch.object(db.orjson, 'loads', wraps=db.orjson.loads) as mock_loads:
+            first = db._decode_quotes_payload(payload)
+            second = db._decode_quotes_payload(payload)
+
+        assert first == [{"author": "A", "text": "T"}]
+        assert second is first
+        mock_loads.assert_called_once()
+
+
+@pytest.mark.xdist_group(name="TestConnectionPool")
+class TestConnectionPool:
+    """Test cases for the pooled database connections."""
+
+    def test_pooled_connection_is_reused(self):
+        """Test that a released connection is handed out again."""
+        import db
+
+        mock_connection = MagicMock()
+        with patch.object(db, '_POOL', db.queue.Queue(maxsize=2)), \
+             patch.object(db, '_start_pool_health_check'), \
+             patch.object(db, 'get_db_connection', return_value=mock_connection) as mock_connect:
+            with db.pooled_connection() as first:
+                pass
+            with db.pooled_connection() as second:
+                pass
+
+        assert first is second is mock_connection
+        mock_connect.assert_called_once()
+        mock_connection.rollback.assert_called()
+        mock_connection.close.assert_not_called()
+
+    def test_broken_connection_is_discarded(self):
+        """Test that a connection failing rollback is closed, not pooled."""
+        import db
+
+        mock_connection = MagicMock()
+        mock_connection.rollback.side_effect = Exception("Communication link failure")
+        with patch.object(db, '_POOL', db.queue.Queue(maxsize=2)) as pool:
+            db.release_connection(mock_connection)
+            assert pool.empty()
+
+        mock_connection.close.assert_called_once()
+
+    def test_health_check_closes_its_cursor(self):
+        """Test that the pool health probe closes the cursor it opens, healthy or not."""
+        import db
+
+        healthy, stale = MagicMock(), MagicMock()
+        stale.cursor.return_value.execute.side_effect = Exception("Communication link failure")
+
+        assert db._is_healthy(healthy) is True
+        assert db._is_healthy(stale) is False
+        healthy.cursor.return_value.close.assert_called_once()
+        stale.cursor.return_value.close.assert_called_once()
+
+    def test_get_db_connection_fails_fast_when_disabled(self):
+        """Test that an unconfigured database short-circuits later connection attempts."""
+        import db
+
+        with patch.object(db, '_DB_DISABLED', None), \
+             patch.object(db, '_load_pyodbc', side_effect=db.DBNotConfigured("pyodbc not available in runtime")) as mock_load:
+            db.ensure_schema_and_seed()
+            with pytest.raises(db.DBNotConfigured, match="pyodbc not available"):
+                db.get_db_connection()
+
+        mock_load.assert_called_once()
+
+
+@pytest.mark.xdist_group(name="TestDatabaseSeeding")
+class TestDatabaseSeeding:
+    """Test cases for seeding an empty quotes table."""
+
+    def test_seed_uses_batched_executemany(self):
+        """Test that seed rows are inserted in batches, not one execute per quote."""
+        import db
+
+        quotes = [{"author": f"Author {i}", "text": f"Quote {i}"} for i in range(5)]
+        mock_cursor = MagicMock()
+        mock_cursor.fetchone.return_value = (0,)
+
+        with patch.object(db, '_load_quotes_securely', return_value=quotes), \
+             patch.object(db, '_SEED_BATCH_SIZE', 2):
+            db._seed_if_empty(mock_cursor)
+
+        assert mock_cursor.fast_executemany is True
+        assert mock_cursor.executemany.call_count == 3
+        inserted = [row for call in mock_cursor.executemany.call_args_list for row in call[0][1]]
+        assert inserted == [(q["author"], q["text"]) for q in quotes]
+
+
+@pytest.mark.xdist_group(name="TestRandomQuote")
+class TestRandomQuote:
+    """Test cases for random quote selection."""
+
+    def test_fetch_random_quote_uses_id_seek(self):
+        """Test that a cached id range turns the pick into a parameterized seek."""
+        import db
+
+        mock_cursor = MagicMock()
+        mock_cursor.fetchone.return_value = (3, "Author", "Quote")
+
+        with patch.object(db, '_QUOTE_ID_RANGE', (1, 5)), \
+             patch.object(db, '_QUOTE_ID_RANGE_EXPIRES', float('inf')):
+            row = db.fetch_random_quote(mock_cursor)
+
+        assert row == (3, "Author", "Quote")
+        sql, rid = mock_cursor.execute.call_args[0]
+        assert "WHERE q.id >= ?" in sql
+        assert "NEWID" not in sql
+        assert 1 <= rid <= 5
+
+    def test_fetch_random_quote_falls_back_to_newid(self):
+        """Test that a seek missing even on a re-read range falls back to ORDER BY NEWID()."""
+        import db
+
+        mock_cursor = MagicMock()
+        # Seek, range re-read, seek again, NEWID()
+        mock_cursor.fetchone.side_effect = [None, (1, 5), None, (2, "Author", "Quote")]
+
+        with patch.object(db, '_QUOTE_ID_RANGE', (1, 5)), \
+             patch.object(db, '_QUOTE_ID_RANGE_EXPIRES', float('inf')):
+            row = db.fetch_random_quote(mock_cursor)
+
+        assert row == (2, "Author", "Quote")
+        assert "ORDER BY NEWID()" in mock_cursor.execute.call_args[0][0]
+
+    def test_fetch_random_quote_rereads_range_on_miss(self):
+        """Test that a missed seek re-reads the id range before giving up on the seek."""
+        import db
+
+        mock_cursor = MagicMock()
+        mock_cursor.fetchone.side_effect = [None, (20, 30), (25, "Author", "Quote")]
+
+        with patch.object(db, '_QUOTE_ID_RANGE', (1, 5)), \
+             patch.object(db, '_QUOTE_ID_RANGE_EXPIRES', float('inf')):
+            row = db.fetch_random_quote(mock_cursor)
+            assert db._QUOTE_ID_RANGE == (20, 30)
+
+        assert row == (25, "Author", "Quote")
+        sql, rid = mock_cursor.execute.call_args[0]
+        assert "WHERE q.id >= ?" in sql
+        assert 20 <= rid <= 30
+
+    def test_fetch_random_quote_rereads_expired_range(self):
+        """Test that rows inserted above a cached MAX(id) become reachable after the TTL."""
+        import db
+
+        mock_cursor = MagicMock()
+        mock_cursor.fetchone.side_effect = [(1, 50), (42, "Author", "Quote")]
+
+        with patch.object(db, '_QUOTE_ID_RANGE', (1, 5)), \
+             patch.object(db, '_QUOTE_ID_RANGE_EXPIRES', 0.0):
+            row = db.fetch_random_quote(mock_cursor)
+            assert db._QUOTE_ID_RANGE == (1, 50)
+            assert db._QUOTE_ID_RANGE_EXPIRES > db.time.monotonic()
+
+        assert row == (42, "Author", "Quote")
+        assert "MIN(id), MAX(id)" in mock_cursor.execute.call_args_list[0][0][0]
+
+
+@pytest.mark.xdist_group(name="TestHealthEndpoint")
+class TestHealthEndpoint:
+    """Test cases for the liveness probe endpoint."""
+
+    def test_healthz_returns_static_json(self):
+        """Test that /healthz serves the precomputed JSON body."""
+        from app.main import create_app
+
+        response = create_app().test_client().get('/healthz')
+        assert response.status_code == 200
+        assert response.mimetype == 'application/json'
+        assert response.get_json() == {"status": "ok"}
@@ -0,0 +1,239 @@
+"""
+Unit tests for the Azure Automation cleanup runbook.
+"""
+
+import pytest
+import asyncio
+import base64
+import importlib.util
+import json
+import sys
+import time
+from collections import Counter
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import requests
+from urllib3.util.retry import RequestHistory
+
+# Import scripts/azure-automation-cleanup.py once, under the module name its hyphen rules out.
+# basicConfig is skipped so the runbook's buffered log handler stays off pytest's root logger.
+scripts_dir = Path(__file__).parent.parent.parent / "scripts"
+_spec = importlib.util.spec_from_file_location("azure_automation_cleanup", scripts_dir / "azure-automation-cleanup.py")
+sys.modules["azure_automation_cleanup"] = importlib.util.module_from_spec(_spec)
+with patch('logging.basicConfig'):
+    _spec.loader.exec_module(sys.modules["azure_automation_cleanup"])
+
+import azure_automation_cleanup
+from azure_automation_cleanup import AzureCleanupManager, WEBHOOK_RETRY_BUDGET_SECONDS, _build_webhook_retry
+
+
+@pytest.fixture
+def cleanup_manager():
+    """
+    AzureCleanupManager with the credential and ResourceManagementClient patched where they
+    are defined (both are imported inside __init__) and a mock HTTP session.
+    """
+    with patch('azure.identity.DefaultAzureCredential'), \
+         patch('azure.mgmt.resource.ResourceManagementClient'):
+        yield AzureCleanupManager("test-subscription", "https://hooks.example.com/hook", session=MagicMock())
+
+
+def _failed_attempts(retry, count):
+    """Return retry as it stands after count consecutive 503 responses."""
+    history = tuple(RequestHistory("POST", "/hook", None, 503, None) for _ in range(count))
+    return retry.new(history=history, total=retry.total - count)
+
+
+@pytest.mark.xdist_group(name="TestWebhookRetry")
+class TestWebhookRetry:
+    """Test cases for the webhook's jittered backoff and retry time budget."""
+
+    @pytest.mark.parametrize("jitter", [0.75, 1.25])
+    def test_backoff_jitter(self, jitter):
+        """Test the exponential backoff is scaled by a +/-25% jitter factor."""
+        retry = _failed_attempts(_build_webhook_retry(), 3)
+
+        with patch.object(azure_automation_cleanup.random, 'uniform', return_value=jitter) as mock_uniform:
+            backoff = retry.get_backoff_time()
+
+        mock_uniform.assert_called_once_with(0.75, 1.25)
+        # backoff_factor 1 after three consecutive errors: 1 * 2 ** (3 - 1) seconds
+        assert backoff == pytest.approx(4 * jitter)
+
+    def test_budget_spans_every_attempt(self):
+        """Test the first failure's time is carried over to each later attempt."""
+        with patch.object(azure_automation_cleanup.time, 'monotonic', side_effect=[1000.0, 1030.0]):
+            first = _failed_attempts(_build_webhook_retry(), 1)
+            second = _failed_attempts(first, 1)
+
+        assert first.first_failure_at == 1000.0
+        assert second.first_failure_at == 1000.0
+
+    def test_budget_cutoff(self):
+        """Test retries stop once the time budget is spent even with attempts left."""
+        with patch.object(azure_automation_cleanup.time, 'monotonic', return_value=1000.0):
+            retry = _failed_attempts(_build_webhook_retry(), 1)
+        assert retry.total > 0
+
+        with patch.object(azure_automation_cleanup.time, 'monotonic',
+                          return_value=1000.0 + WEBHOOK_RETRY_BUDGET_SECONDS - 1):
+            assert not retry.is_exhausted()
+        with patch.object(azure_automation_cleanup.time, 'monotonic',
+                          return_value=1000.0 + WEBHOOK_RETRY_BUDGET_SECONDS + 1):
+            assert retry.is_exhausted()
+
+    def test_attempt_limit_within_budget(self):
+        """Test running out of attempts ends retries before the time budget is spent."""
+        retry = _build_webhook_retry()
+
+        assert not retry.is_exhausted()
+        assert retry.new(total=-1).is_exhausted()
+
+
+@pytest.mark.xdist_group(name="TestWebhookDeadLetter")
+class TestWebhookDeadLetter:
+    """Test cases for parking undeliverable notifications on the dead-letter queue."""
+
+    def test_failed_webhook_is_dead_lettered(self, cleanup_manager, monkeypatch):
+        """Test a notification whose delivery failed is sent to the queue as base64 JSON."""
+        monkeypatch.setattr(azure_automation_cleanup, 'DLQ_ACCOUNT', "demodlq")
+        cleanup_manager._session.post.side_effect = requests.ConnectionError("connection refused")
+
+        with patch('azure.storage.queue.QueueClient') as mock_queue_client:
+            cleanup_manager.send_webhook_notification("Cleanup failed", "ERROR")
+
+        mock_queue_client.assert_called_once_with(
+            "https://demodlq.queue.core.windows.net", "cleanup-dlq", credential=cleanup_manager.credential
+        )
+        queue = mock_queue_client.return_value.__enter__.return_value
+        queue.send_message.assert_called_once()
+        payload = json.loads(base64.b64decode(queue.send_message.call_args.args[0]))
+        assert payload["text"] == "Azure WebApp Demo Cleanup: ERROR"
+        assert payload["attachments"][0]["color"] == "danger"
+        assert payload["attachments"][0]["fields"][1]["value"] == "Cleanup failed"
+
+    def test_http_error_is_dead_lettered(self, cleanup_manager, monkeypatch):
+        """Test an error status from the webhook also dead-letters, to a full queue endpoint URL."""
+        monkeypatch.setattr(azure_automation_cleanup, 'DLQ_ACCOUNT', "https://demodlq.queue.core.windows.net")
+        response = cleanup_manager._session.post.return_value
+        response.raise_for_status.side_effect = requests.HTTPError("503 Server Error")
+
+        with patch('azure.storage.queue.QueueClient') as mock_queue_client:
+            cleanup_manager.send_webhook_notification("Cleanup done", "SUCCESS")
+
+        assert mock_queue_client.call_args.args[0] == "https://demodlq.queue.core.windows.net"
+        mock_queue_client.return_value.__enter__.return_value.send_message.assert_called_once()
+
+    def test_no_dead_letter_without_account(self, cleanup_manager, monkeypatch):
+        """Test nothing is queued when no dead-letter account is configured."""
+        monkeypatch.setattr(azure_automation_cleanup, 'DLQ_ACCOUNT', None)
+        cleanup_manager._session.post.side_effect = requests.ConnectionError("connection refused")
+
+        with patch('azure.storage.queue.QueueClient') as mock_queue_client:
+            cleanup_manager.send_webhook_notification("Cleanup failed", "ERROR")
+
+        mock_queue_client.assert_not_called()
+
+    def test_delivered_webhook_is_not_dead_lettered(self, cleanup_manager, monkeypatch):
+        """Test a delivered notification is not queued."""
+        monkeypatch.setattr(azure_automation_cleanup, 'DLQ_ACCOUNT', "demodlq")
+
+        with patch('azure.storage.queue.QueueClient') as mock_queue_client:
+            cleanup_manager.send_webhook_notification("Cleanup done", "SUCCESS")
+
+        cleanup_manager._session.post.assert_called_once()
+        mock_queue_client.assert_not_called()
+
+
+@pytest.mark.xdist_group(name="TestPrefetchFallback")
+class TestPrefetchFallback:
+    """Test cases for falling back to individual requests when the ARM batch cannot be used."""
+
+    @pytest.fixture(autouse=True)
+    def batch_response(self, cleanup_manager):
+        """ARM token plus a batch whose resource listing sub-request failed."""
+        cleanup_manager.credential.get_token.return_value = SimpleNamespace(
+            token="test-token", expires_on=time.time() + 3600
+        )
+        response = cleanup_manager._session.post.return_value
+        response.json.return_value = {"responses": [
+            {"name": "0", "httpStatusCode": 200, "content": {"name": "webapp-demo-rg"}},
+            {"name": "1", "httpStatusCode": 500, "content": {"error": {"code": "InternalServerError"}}},
+            {"name": "2", "httpStatusCode": 200, "content": {"properties": {"columns": [], "rows": []}}},
+        ]}
+        return response
+
+    def test_failed_sub_request_checks_existence(self, cleanup_manager):
+        """Test a failed sub-request falls back to check_existence and a per-group listing."""
+        resource_groups = cleanup_manager.resource_client.resource_groups
+        resource_groups.check_existence.return_value = True
+        cleanup_manager.resource_client.resources.list_by_resource_group.return_value = [
+            SimpleNamespace(type="Microsoft.Web/sites"),
+            SimpleNamespace(type="Microsoft.Web/sites"),
+            SimpleNamespace(type="Microsoft.Sql/servers"),
+        ]
+
+        exists, resource_types, cost_info = cleanup_manager._prefetch_rg_state("webapp-demo-rg")
+
+        cleanup_manager._session.post.assert_called_once()
+        resource_groups.check_existence.assert_called_once_with("webapp-demo-rg")
+        assert exists is True
+        assert resource_types == Counter({"Microsoft.Web/sites": 2, "Microsoft.Sql/servers": 1})
+        assert cost_info.startswith("Cost data retrieved for period")
+
+    def test_failed_sub_request_for_missing_group(self, cleanup_manager):
+        """Test a group that check_existence reports as gone is not listed."""
+        cleanup_manager.resource_client.resource_groups.check_existence.return_value = False
+
+        assert cleanup_manager._prefetch_rg_state("webapp-demo-rg") == (False, Counter(), "")
+        cleanup_manager.resource_client.resources.list_by_resource_group.assert_not_called()
+
+    def test_failed_batch_request_checks_existence(self, cleanup_manager, batch_response):
+        """Test an error from the batch POST itself takes the same fallback."""
+        batch_response.raise_for_status.side_effect = requests.HTTPError("429 Too Many Requests")
+        cleanup_manager.resource_client.resource_groups.check_existence.return_value = False
+
+        assert cleanup_manager._prefetch_rg_state("webapp-demo-rg") == (False, Counter(), "")
+        cleanup_manager.resource_client.resource_groups.check_existence.assert_called_once_with("webapp-demo-rg")
+
+
+@pytest.mark.xdist_group(name="TestDeleteResourceGroup")
+class TestDeleteResourceGroup:
+    """Test cases for awaiting resource group deletion."""
+
+    @pytest.fixture
+    def delete_client(self, cleanup_manager):
+        """Patch the async credential and aio ResourceManagementClient; yield the client mock."""
+        with patch.object(cleanup_manager, '_get_async_azure_credential', return_value=MagicMock()), \
+             patch('azure.mgmt.resource.resources.aio.ResourceManagementClient') as mock_client_class:
+            client = mock_client_class.return_value.__aenter__.return_value
+            client.resource_groups.begin_delete = AsyncMock(return_value=MagicMock(result=AsyncMock()))
+            yield client
+
+    def test_delete_completes(self, cleanup_manager, delete_client):
+        """Test a finished deletion reports success."""
+        assert asyncio.run(cleanup_manager.delete_resource_group("webapp-demo-rg")) is True
+        delete_client.resource_groups.begin_delete.assert_awaited_once()
+        assert delete_client.resource_groups.begin_delete.call_args.args == ("webapp-demo-rg",)
+
+    def test_delete_timeout(self, cleanup_manager, delete_client):
+        """Test a deletion still running after the 10 minute timeout reports failure."""
+        timeouts = []
+
+        async def timed_out(awaitable, timeout):
+            timeouts.append(timeout)
+            awaitable.close()
+            raise asyncio.TimeoutError
+
+        with patch.object(azure_automation_cleanup.asyncio, 'wait_for', timed_out):
+            assert asyncio.run(cleanup_manager.delete_resource_group("webapp-demo-rg")) is False
+
+        assert timeouts == [600]
+
+    def test_delete_failure(self, cleanup_manager, delete_client):
+        """Test an error starting the deletion reports failure."""
+        delete_client.resource_groups.begin_delete.side_effect = RuntimeError("AuthorizationFailed")
+
+        assert asyncio.run(cleanup_manager.delete_resource_group("webapp-demo-rg")) is False
@@ -3,130 +3,304 @@ Unit tests for cost monitoring functionality.
 """
 
 import pytest
+import importlib.util
 import json
-from unittest.mock import patch, MagicMock, mock_open
+import re
+import subprocess
+from unittest.mock import patch
 import sys
 from pathlib import Path
+from types import SimpleNamespace
+from datetime import timedelta
 
-# Add scripts directory to path
+# Import scripts/azure-cost-monitor.py once, under the module name its hyphen rules out
 scripts_dir = Path(__file__).parent.parent.parent / "scripts"
-sys.path.insert(0, str(scripts_dir))
+_spec = importlib.util.spec_from_file_location("azure_cost_monitor", scripts_dir / "azure-cost-monitor.py")
+sys.modules["azure_cost_monitor"] = importlib.util.module_from_spec(_spec)
+_spec.loader.exec_module(sys.modules["azure_cost_monitor"])
 
+import azure_cost_monitor
+from azure_cost_monitor import AzureCostMonitor, CostCache, _resource_group_of, budget_status, format_cost_report
 
+
+@pytest.fixture(autouse=True)
+def cost_cache_dir(tmp_path, monkeypatch):
+    """Point the script's on-disk caches at a per-test directory instead of the user's."""
+    monkeypatch.setattr(azure_cost_monitor, 'CACHE_DIR', tmp_path)
+    monkeypatch.setattr(azure_cost_monitor, 'COST_CACHE_PATH', tmp_path / "costs.sqlite3")
+    return tmp_path
+
+
+@pytest.fixture
+def azure_clients_mocked():
+    """
+    Patch the Azure SDK credential and clients AzureCostMonitor builds (imported inside its
+    __init__, so patched where they are defined) and yield the ResourceManagementClient mock.
+    """
+    with patch('azure.identity.ChainedTokenCredential'), \
+         patch('azure.mgmt.costmanagement.CostManagementClient'), \
+         patch('azure.mgmt.resource.ResourceManagementClient') as mock_resource_client:
+        yield mock_resource_client
+
+
+@pytest.mark.xdist_group(name="TestAzureCostMonitor")
 class TestAzureCostMonitor:
     """Test cases for Azure Cost Monitor functionality."""
     
-    @patch('azure_cost_monitor.DefaultAzureCredential')
-    @patch('azure_cost_monitor.CostManagementClient')
-    @patch('azure_cost_monitor.ResourceManagementClient')
-    def test_cost_monitor_initialization(self, mock_resource_client, mock_cost_client, mock_credential):
+    def test_cost_monitor_initialization(self, azure_clients_mocked):
         """Test AzureCostMonitor initialization."""
-        from azure_cost_monitor import AzureCostMonitor
-        
         monitor = AzureCostMonitor("test-subscription", "test-project")
         
         assert monitor.subscription_id == "test-subscription"
         assert monitor.project_name == "test-project"
-        mock_credential.assert_called_once()
+        azure_clients_mocked.assert_called_once_with(monitor.credential, "test-subscription")
     
     @patch('azure_cost_monitor.subprocess.run')
-    def test_get_subscription_info(self, mock_run):
+    def test_get_subscription_info(self, mock_run, azure_clients_mocked):
         """Test subscription information retrieval."""
-        from azure_cost_monitor import AzureCostMonitor
-        
         # Mock subprocess response
-        mock_result = MagicMock()
-        mock_result.stdout = '{"id": "test-sub", "name": "Test Subscription"}'
-        mock_run.return_value = mock_result
-        
-        with patch('azure_cost_monitor.DefaultAzureCredential'), \
-             patch('azure_cost_monitor.CostManagementClient'), \
-             patch('azure_cost_monitor.ResourceManagementClient'):
-            
-            monitor = AzureCostMonitor("test-subscription", "test-project")
-            info = monitor.get_subscription_info()
-            
-            assert info['id'] == "test-sub"
-            assert info['name'] == "Test Subscription"
-    
-    def test_get_project_resource_groups(self):
-        """Test project resource group discovery."""
-        from azure_cost_monitor import AzureCostMonitor
+        mock_run.return_value = SimpleNamespace(returncode=0, stdout=b'{"id": "test-sub", "name": "Test Subscription"}')
         
-        # Mock resource group with tags
-        mock_rg = MagicMock()
-        mock_rg.name = "webapp-demo-dev-rg"
-        mock_rg.tags = {"Project": "webapp-demo"}
-        
-        with patch('azure_cost_monitor.DefaultAzureCredential'), \
-             patch('azure_cost_monitor.CostManagementClient'), \
-             patch('azure_cost_monitor.ResourceManagementClient') as mock_resource_client:
-            
-            mock_resource_client.return_value.resource_groups.list.return_value = [mock_rg]
-            
-            monitor = AzureCostMonitor("test-subscription", "webapp-demo")
-            resource_groups = monitor.get_project_resource_groups()
-            
-            assert "webapp-demo-dev-rg" in resource_groups
+        monitor = AzureCostMonitor("test-subscription", "test-project")
+        info = monitor.get_subscription_info()
+        
+        assert info['id'] == "test-sub"
+        assert info['name'] == "Test Subscription"
+        
+        # Looked up once per monitor
+        assert monitor.get_subscription_info() is info
+        mock_run.assert_called_once()
     
     @patch('azure_cost_monitor.subprocess.run')
-    def test_get_cost_data_via_cli(self, mock_run):
-        """Test cost data retrieval via Azure CLI."""
-        from azure_cost_monitor import AzureCostMonitor
-        
-        # Mock successful CLI responses
-        mock_run.side_effect = [
-            MagicMock(returncode=0, stdout="", text=True),  # Resource group check
-            MagicMock(returncode=0, stdout='[{"cost": "10.50", "service": "App Service"}]', text=True)  # Cost data
+    def test_cached_subscription_id(self, mock_run, cost_cache_dir):
+        """Test that the subscription ID is read from sub.json while it is fresh."""
+        mock_run.return_value = SimpleNamespace(returncode=0, stdout="sub-1\n")
+        
+        assert azure_cost_monitor._cached_subscription_id() == "sub-1"
+        assert json.loads((cost_cache_dir / "sub.json").read_text())['id'] == "sub-1"
+        
+        mock_run.return_value = SimpleNamespace(returncode=0, stdout="sub-2\n")
+        assert azure_cost_monitor._cached_subscription_id() == "sub-1"
+        assert mock_run.call_count == 1
+        
+        # --refresh-cache bypasses the cache and rewrites it
+        assert azure_cost_monitor._cached_subscription_id(refresh=True) == "sub-2"
+        assert azure_cost_monitor._cached_subscription_id() == "sub-2"
+        assert mock_run.call_count == 2
+    
+    @patch('azure_cost_monitor.subprocess.run')
+    def test_cached_subscription_id_expired(self, mock_run, cost_cache_dir):
+        """Test that a sub.json older than its TTL is looked up again."""
+        stale = azure_cost_monitor.time.time() - azure_cost_monitor.SUBSCRIPTION_CACHE_TTL_SECONDS - 1
+        (cost_cache_dir / "sub.json").write_text(json.dumps({'id': "old-sub", 'ts': stale}))
+        mock_run.return_value = SimpleNamespace(returncode=0, stdout="new-sub\n")
+        
+        assert azure_cost_monitor._cached_subscription_id() == "new-sub"
+        mock_run.assert_called_once()
+    
+    def test_get_project_resource_groups(self, azure_clients_mocked):
+        """Test project resource group discovery."""
+        # Mock resource group with tags
+        mock_rg = SimpleNamespace(name="webapp-demo-dev-rg", tags={"Project": "webapp-demo"})
+        
+        azure_clients_mocked.return_value.resource_groups.list.return_value = [mock_rg]
+        
+        monitor = AzureCostMonitor("test-subscription", "webapp-demo")
+        resource_groups = monitor.get_project_resource_groups()
+        
+        assert "webapp-demo-dev-rg" in resource_groups
+    
+    def test_get_cost_data_via_cli(self, azure_clients_mocked):
+        """Test cost data retrieval from the Cost Management query."""
+        monitor = AzureCostMonitor("test-subscription", "webapp-demo")
+        columns = [SimpleNamespace(name='PreTaxCost'), SimpleNamespace(name='ResourceGroup'),
+                   SimpleNamespace(name='Currency')]
+        # One query for the closed days of the period, one for today
+        monitor.cost_client.query.usage.side_effect = [
+            SimpleNamespace(columns=columns,
+                            rows=[[10.5, 'webapp-demo-dev-rg', 'USD'],
+                                  [4.25, 'WEBAPP-DEMO-DEV-RG', 'USD'],
+                                  [3.0, 'webapp-demo-prod-rg', 'USD'],
+                                  [99.0, 'someone-elses-rg', 'USD']]),
+            SimpleNamespace(columns=columns, rows=[[1.0, 'webapp-demo-dev-rg', 'USD']]),
         ]
         
-        with patch('azure_cost_monitor.DefaultAzureCredential'), \
-             patch('azure_cost_monitor.CostManagementClient'), \
-             patch('azure_cost_monitor.ResourceManagementClient'):
-            
-            monitor = AzureCostMonitor("test-subscription", "webapp-demo")
-            
-            # Mock resource groups
-            with patch.object(monitor, 'get_project_resource_groups', return_value=['webapp-demo-dev-rg']):
-                cost_data = monitor._get_cost_data_via_cli(30, None)
-                
-                assert 'total_cost' in cost_data
-                assert 'breakdown' in cost_data
-    
-    def test_check_budget_alerts(self):
+        with patch.object(monitor, 'get_project_resource_groups',
+                          return_value=['webapp-demo-dev-rg', 'webapp-demo-prod-rg']):
+            cost_data = monitor._get_cost_data_via_cli(30, None)
+        
+        assert cost_data['total_cost'] == 18.75
+        assert cost_data['breakdown'] == {'webapp-demo-dev-rg': 15.75, 'webapp-demo-prod-rg': 3.0}
+        assert cost_data['data_source'] == 'actual'
+        assert cost_data['attempted_methods'] == ['cost_management']
+        assert monitor.cost_client.query.usage.call_count == 2
+    
+    @pytest.mark.parametrize("use_cli, first, second", [
+        (False, 'sdk', 'cli'),
+        (True, 'cli', 'sdk'),
+    ])
+    def test_discovery_fallback_order(self, azure_clients_mocked, use_cli, first, second):
+        """Test that discovery tries the SDK first unless use_cli, then the other path."""
+        monitor = AzureCostMonitor("test-subscription", "webapp-demo", use_cli=use_cli)
+        calls = []
+        discovered = {'sdk': [], 'cli': []}
+        discovered[second] = ['webapp-demo-dev-rg']
+        
+        def discoverer(name):
+            return lambda: calls.append(name) or discovered[name]
+        
+        with patch.object(monitor, '_discover_resource_groups_via_sdk', side_effect=discoverer('sdk')), \
+             patch.object(monitor, '_discover_resource_groups_via_cli', side_effect=discoverer('cli')):
+            assert monitor.get_project_resource_groups() == ['webapp-demo-dev-rg']
+        
+        assert calls == [first, second]
+    
+    def test_list_resources_missing_group(self, azure_clients_mocked):
+        """Test that a resource group deleted since discovery has no resources on the SDK path."""
+        from azure.core.exceptions import ResourceNotFoundError
+        
+        monitor = AzureCostMonitor("test-subscription", "webapp-demo")
+        monitor.resource_client.resources.list_by_resource_group.side_effect = ResourceNotFoundError("gone")
+        
+        assert list(monitor._list_resources("webapp-demo-dev-rg")) == []
+    
+    @patch('azure_cost_monitor.subprocess.Popen')
+    def test_consumption_costs(self, mock_popen, azure_clients_mocked):
+        """Test that streamed consumption rows are summed per resource group."""
+        mock_popen.return_value.stdout = iter([
+            "/subscriptions/s/resourceGroups/WEBAPP-DEMO-DEV-RG/providers/Microsoft.Web/sites/app\t1.5\n",
+            "/subscriptions/s/resourceGroups/webapp-demo-dev-rg/providers/Microsoft.Sql/servers/db\t2.0\n",
+            "/subscriptions/s/resourceGroups/other-rg/providers/Microsoft.Web/sites/app\t9.0\n",
+            "/subscriptions/s/resourceGroups/webapp-demo-dev-rg/providers/Microsoft.KeyVault/vaults/kv\tNone\n",
+        ])
+        
+        monitor = AzureCostMonitor("test-subscription", "webapp-demo")
+        total, breakdown = monitor._try_consumption_api("2024-01-01", "2024-01-31",
+                                                        ("webapp-demo-dev-rg", "webapp-demo-prod-rg"))
+        
+        assert (total, breakdown) == (3.5, {"webapp-demo-dev-rg": 3.5})
+    
+    @pytest.mark.parametrize("resource_id, expected", [
+        ("/subscriptions/s/resourceGroups/WebApp-Demo-Dev-RG/providers/Microsoft.Web/sites/app", "webapp-demo-dev-rg"),
+        ("/subscriptions/s/resourcegroups/webapp-demo-dev-rg", "webapp-demo-dev-rg"),
+        ("/subscriptions/s/providers/Microsoft.Web/sites/app", None),
+        ("webapp-demo-dev-app", None),
+    ])
+    def test_resource_group_of(self, resource_id, expected):
+        """Test resource group extraction from ARM resource IDs."""
+        assert _resource_group_of(resource_id) == expected
+    
+    def test_check_budget_alerts(self, azure_clients_mocked):
         """Test budget alert checking."""
-        from azure_cost_monitor import AzureCostMonitor
-        
-        with patch('azure_cost_monitor.DefaultAzureCredential'), \
-             patch('azure_cost_monitor.CostManagementClient'), \
-             patch('azure_cost_monitor.ResourceManagementClient'):
-            
-            monitor = AzureCostMonitor("test-subscription", "webapp-demo")
-            
-            # Test critical alert (over budget)
-            alerts = monitor.check_budget_alerts(100.0, 120.0)
-            assert alerts['status'] == 'critical'
-            assert alerts['percentage'] == 120.0
-            assert len(alerts['alerts']) > 0
-            
-            # Test warning alert
-            alerts = monitor.check_budget_alerts(100.0, 80.0)
-            assert alerts['status'] == 'warning'
-            assert alerts['percentage'] == 80.0
-            
-            # Test OK status
-            alerts = monitor.check_budget_alerts(100.0, 50.0)
-            assert alerts['status'] == 'ok'
-            assert alerts['percentage'] == 50.0
+        monitor = AzureCostMonitor("test-subscription", "webapp-demo")
+        
+        # Test critical alert (over budget)
+        alerts = monitor.check_budget_alerts(100.0, 120.0)
+        assert alerts['status'] == 'critical'
+        assert alerts['percentage'] == 120.0
+        assert len(alerts['alerts']) > 0
+        
+        # Test warning alert
+        alerts = monitor.check_budget_alerts(100.0, 80.0)
+        assert alerts['status'] == 'warning'
+        assert alerts['percentage'] == 80.0
+        
+        # Test OK status
+        alerts = monitor.check_budget_alerts(100.0, 50.0)
+        assert alerts['status'] == 'ok'
+        assert alerts['percentage'] == 50.0
 
 
+@pytest.mark.xdist_group(name="TestCostCache")
+class TestCostCache:
+    """Test cases for the per-resource-group cost cache."""
+    
+    def test_ttl_depends_on_period(self, cost_cache_dir):
+        """Test that a closed period outlives the open one still accruing."""
+        cache = CostCache(cost_cache_dir / "costs.sqlite3")
+        cache.put("sub", {"rg": 1.0}, "2024-01-01", "2024-01-31", today="2024-02-15")
+        cache.put("sub", {"rg": 2.0}, "2024-01-16", "2024-02-15", today="2024-02-15")
+        
+        later = azure_cost_monitor.time.time() + azure_cost_monitor.COST_CACHE_TTL_OPEN_SECONDS + 1
+        with patch('azure_cost_monitor.time.time', return_value=later):
+            assert cache.get("sub", ["rg"], "2024-01-01", "2024-01-31") == {"rg": 1.0}
+            assert cache.get("sub", ["rg"], "2024-01-16", "2024-02-15") is None
+    
+    def test_get_requires_every_resource_group(self, cost_cache_dir):
+        """Test that a partial hit is treated as a miss."""
+        cache = CostCache(cost_cache_dir / "costs.sqlite3")
+        cache.put("sub", {"rg-a": 1.0}, "2024-01-01", "2024-01-31", today="2024-02-15")
+        
+        assert cache.get("sub", ["rg-a", "rg-b"], "2024-01-01", "2024-01-31") is None
+    
+    def test_monitor_uses_cost_cache_path(self, azure_clients_mocked, tmp_path):
+        """Test that the monitor keeps its costs in the given cache file."""
+        cache_path = tmp_path / "elsewhere" / "costs.sqlite3"
+        
+        AzureCostMonitor("test-subscription", "webapp-demo", cost_cache_path=cache_path)
+        
+        assert cache_path.exists()
+    
+    def test_cache_hit_skips_cost_query(self, azure_clients_mocked):
+        """Test that fresh cached costs are returned without querying Cost Management."""
+        monitor = AzureCostMonitor("test-subscription", "webapp-demo")
+        start, end = monitor._period(30)
+        (closed_start, closed_end), (today, _) = monitor._cost_slices(start, end)
+        monitor._store_costs({"webapp-demo-dev-rg": 12.5, "webapp-demo-prod-rg": 0.0}, closed_start, closed_end)
+        monitor._store_costs({"webapp-demo-dev-rg": 0.5, "webapp-demo-prod-rg": 0.0}, today, end)
+        
+        total, breakdown, authoritative = monitor._try_cost_management_api(
+            start, end, ("webapp-demo-dev-rg", "webapp-demo-prod-rg"))
+        
+        assert (total, breakdown, authoritative) == (13.0, {"webapp-demo-dev-rg": 13.0}, True)
+        monitor.cost_client.query.usage.assert_not_called()
+    
+    def test_closed_days_outlive_today(self, azure_clients_mocked):
+        """Test that after the open TTL only today's slice of the period is queried again."""
+        monitor = AzureCostMonitor("test-subscription", "webapp-demo")
+        start, end = monitor._period(30)
+        queried = []
+        
+        def query(slice_start, slice_end):
+            queried.append((slice_start, slice_end))
+            return ['PreTaxCost', 'ResourceGroup'], [[2.0, 'webapp-demo-dev-rg']]
+        
+        with patch.object(monitor, '_cost_query_via_sdk', side_effect=query):
+            first = monitor._try_cost_management_api(start, end, ("webapp-demo-dev-rg",))
+            later = azure_cost_monitor.time.time() + azure_cost_monitor.COST_CACHE_TTL_OPEN_SECONDS + 1
+            with patch('azure_cost_monitor.time.time', return_value=later):
+                second = monitor._try_cost_management_api(start, end, ("webapp-demo-dev-rg",))
+        
+        yesterday = (monitor._now - timedelta(days=1)).strftime('%Y-%m-%d')
+        assert queried == [(start, yesterday), (monitor._today, end), (monitor._today, end)]
+        assert first == second == (4.0, {"webapp-demo-dev-rg": 4.0}, True)
+    
+    @pytest.mark.parametrize("force_estimate, data_source, attempted_methods", [
+        (False, 'authoritative_zero', ['cost_management']),
+        (True, 'estimated', ['cost_management', 'consumption', 'estimate']),
+    ])
+    def test_authoritative_zero(self, azure_clients_mocked, force_estimate, data_source, attempted_methods):
+        """Test that a zero Cost Management answer stops the fallbacks unless forced."""
+        monitor = AzureCostMonitor("test-subscription", "webapp-demo", force_estimate=force_estimate)
+        
+        with patch.object(monitor, 'get_project_resource_groups', return_value=['webapp-demo-dev-rg']), \
+             patch.object(monitor, '_cost_query_via_sdk', return_value=(['PreTaxCost', 'ResourceGroup'], [])), \
+             patch.object(monitor, '_try_consumption_api', return_value=(0.0, {})), \
+             patch.object(monitor, '_estimate_from_resources',
+                          return_value=(13.0, {'webapp-demo-dev-rg': 13.0}, {})):
+            cost_data = monitor._get_cost_data_via_cli(30)
+        
+        assert cost_data['data_source'] == data_source
+        assert cost_data['attempted_methods'] == attempted_methods
+        assert cost_data['total_cost'] == (13.0 if force_estimate else 0.0)
+
+
+@pytest.mark.xdist_group(name="TestCostReporting")
 class TestCostReporting:
     """Test cases for cost reporting functionality."""
     
     def test_format_cost_report(self):
         """Test cost report formatting."""
-        from azure_cost_monitor import format_cost_report
-        
         cost_data = {
             'total_cost': 25.50,
             'breakdown': {
@@ -146,8 +320,6 @@ class TestCostReporting:
     
     def test_format_cost_report_empty(self):
         """Test cost report formatting with empty data."""
-        from azure_cost_monitor import format_cost_report
-        
         cost_data = {
             'total_cost': 0.0,
             'breakdown': {},
@@ -161,52 +333,36 @@ class TestCostReporting:
         assert "webapp-demo" in report
 
 
+@pytest.mark.xdist_group(name="TestCostEstimation")
 class TestCostEstimation:
     """Test cases for cost estimation functionality."""
     
-    def test_cost_estimation_dev(self):
-        """Test cost estimation for development environment."""
-        # This would test the cost estimation logic from cost-monitor.sh
-        # Since it's a bash script, we'll test the Python equivalent logic
-        
-        base_cost_dev = 25
-        regional_multiplier = 1.02  # westus2
-        
-        estimated_cost = base_cost_dev * regional_multiplier
-        
-        assert estimated_cost == 25.50
-    
-    def test_cost_estimation_prod(self):
-        """Test cost estimation for production environment."""
-        base_cost_prod = 100
-        regional_multiplier = 1.0  # eastus
-        
-        estimated_cost = base_cost_prod * regional_multiplier
-        
-        assert estimated_cost == 100.0
-    
-    def test_regional_multipliers(self):
-        """Test regional cost multipliers."""
-        multipliers = {
-            'eastus': 1.0,
-            'westus': 1.05,
-            'westus2': 1.02,
-            'centralus': 1.0,
-            'southcentralus': 1.03
-        }
+    @pytest.mark.parametrize("environment", ['dev', 'staging', 'prod'])
+    def test_cost_estimation(self, tmp_path, environment):
+        """Test cost-monitor.sh's estimate, its budget check and its JSON export."""
+        export_file = tmp_path / "estimate.json"
+        result = subprocess.run(
+            [str(scripts_dir / "cost-monitor.sh"), '--estimate', '--env', environment,
+             '--budget', '10', '--export', str(export_file)],
+            capture_output=True, text=True
+        )
         
-        base_cost = 100
+        assert result.returncode == 0, result.stderr
+        match = re.search(r'^Total estimated cost:\s+\$([0-9.]+)$', result.stdout, re.M)
+        assert match is not None
+        assert "is within budget ($10)" in result.stdout
         
-        for region, multiplier in multipliers.items():
-            estimated = base_cost * multiplier
-            assert estimated >= base_cost  # Should never be less than base cost
+        exported = json.loads(export_file.read_text())
+        assert exported['environment'] == environment
+        assert exported['budget_usd'] == 10
+        assert exported['estimated_cost_usd'] == pytest.approx(float(match.group(1)))
 
 
+@pytest.mark.xdist_group(name="TestCostDashboard")
 class TestCostDashboard:
     """Test cases for cost dashboard functionality."""
     
-    @patch('builtins.open', new_callable=mock_open)
-    def test_dashboard_generation(self, mock_file):
+    def test_dashboard_generation(self):
         """Test HTML dashboard generation."""
         # This tests the concept - actual implementation is in bash
         dashboard_data = {
@@ -225,16 +381,13 @@ class TestCostDashboard:
         assert dashboard_data['project_name'] in html_content
         assert str(dashboard_data['total_cost']) in html_content
     
-    def test_budget_alert_styling(self):
+    @pytest.mark.parametrize("percentage,alert_class", [
+        (120, 'alert-critical'),
+        (100, 'alert-critical'),
+        (80, 'alert-warning'),
+        (75, 'alert-warning'),
+        (50, 'alert-ok'),
+    ])
+    def test_budget_alert_styling(self, percentage, alert_class):
         """Test budget alert CSS class selection."""
-        def get_alert_class(percentage):
-            if percentage >= 100:
-                return 'alert-critical'
-            elif percentage >= 75:
-                return 'alert-warning'
-            else:
-                return 'alert-ok'
-        
-        assert get_alert_class(120) == 'alert-critical'
-        assert get_alert_class(80) == 'alert-warning'
-        assert get_alert_class(50) == 'alert-ok'
+        assert f"alert-{budget_status(percentage)}" == alert_class